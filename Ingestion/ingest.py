@@ -1,19 +1,74 @@
 import os
-import pandas as pd
+import re
+import tempfile
+import multiprocessing
+import threading
+import json
+import urllib.request
+import urllib.error
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
 from collections import defaultdict
-from bs4 import BeautifulSoup
-from unstructured.partition.pdf import partition_pdf
-from unstructured.partition.csv import partition_csv
-from unstructured.partition.xlsx import partition_xlsx
-import unstructured_client
-from unstructured_client.models import operations, shared
+from openpyxl import load_workbook
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 from dotenv import load_dotenv, find_dotenv
 
 
 _ = load_dotenv(find_dotenv())
 
+# Normalised bordereaux column headers for each ClaimsBorderaux field, most specific first.
+# Headers are matched both with their merged group header prefixed ("amount paid ...") and on their own.
+CLAIMS_BORDERAUX_COLUMNS = {
+    "policy_holder_id": ["policy holder id", "policyholder id"],
+    "member_id": ["member id"],
+    "start_date_of_cover": ["start date of cover", "cover start date"],
+    "end_date_of_cover": ["end date of cover", "cover end date"],
+    "date_of_claim_treatment_date": ["date of claim treatment date", "date of claim", "treatment date"],
+    "date_of_payment_approval_date": ["date of payment approval date", "date of payment", "approval date"],
+    "outpatient_per_family": ["amount paid outpatient per family", "outpatient per family"],
+    "inpatient_per_family": ["amount paid inpatient per family", "inpatient per family"],
+    "dental_per_individual": ["amount paid dental per individual", "dental per individual"],
+    "optic_per_individual": ["amount paid optic per individual", "optic per individual"],
+    "spectacle_frame_per_individual": ["amount paid spectacle frame per individual", "spectacle frame per individual"],
+    "death_and_total_permanent_disability_cover_per_individual_claims": [
+        "amount paid death and total permanent disability cover per individual",
+        "death and total permanent disability cover per individual",
+    ],
+    "total_claims_paid": ["amount paid total claims paid", "total claims paid"],
+}
+
+CLAIMS_BORDERAUX_DATE_FIELDS = {
+    "start_date_of_cover", "end_date_of_cover", "date_of_claim_treatment_date", "date_of_payment_approval_date"
+}
+CLAIMS_BORDERAUX_TEXT_FIELDS = {"policy_holder_id", "member_id"}
+
+# Number of leading rows searched for the header of a bordereaux sheet
+HEADER_SEARCH_ROWS = 10
+
+# Pages with less embedded text than this are treated as scanned and sent to hi_res OCR
+MIN_TEXT_LAYER_CHARS = 50
+# Pages with this many vector paths (table ruling) or lines of figures are treated as tables
+TABLE_MIN_PATH_OBJECTS = 50
+TABLE_MIN_NUMERIC_LINES = 5
+NUMBER_PATTERN = re.compile(r'\d[\d,.]*\d|\d')
+
+# hi_res pages are partitioned in a process pool, PDF_PARTITION_PAGES_PER_TASK pages per task
+PDF_PARTITION_WORKERS = int(os.getenv("PDF_PARTITION_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARTITION_PAGES_PER_TASK = int(os.getenv("PDF_PARTITION_PAGES_PER_TASK", "2"))
+
+# Optional long-lived partition worker (python -m Ingestion.partition_worker) that keeps the model warm
+PARTITION_WORKER_URL = os.getenv("PARTITION_WORKER_URL")
+PARTITION_WORKER_TIMEOUT = int(os.getenv("PARTITION_WORKER_TIMEOUT", "900"))
+
+# Created on first use and kept for the life of the process so workers keep their loaded model
+partition_pool = None
+partition_pool_lock = threading.Lock()
+
 class UnstructuredAPIProcessor:
     def __init__(self):
+        # The client is only loaded when the Unstructured API is actually used
+        import unstructured_client
         api_key = os.getenv('UNSTRUCTURED_API_KEY')
         server_url = os.getenv('UNSTRUCTURED_API_URL', 'https://api.unstructuredapp.io')
         self.client = unstructured_client.UnstructuredClient(
@@ -21,10 +76,16 @@ class UnstructuredAPIProcessor:
             server_url=server_url
         )
 
-    def _process_file(self, file_path, strategy=shared.Strategy.HI_RES, languages=['eng']):
+    def _process_file(self, file_path, strategy=None, languages=['eng']):
+        from unstructured_client.models import operations, shared
+        if strategy is None:
+            strategy = shared.Strategy.HI_RES
+
+        # The client takes the file content as bytes and builds the whole multipart body in
+        # memory (the split-PDF hook reads it back from bytes too), so the file is read in full
         with open(file_path, "rb") as f:
             data = f.read()
-        
+
         req = operations.PartitionRequest(
             partition_parameters=shared.PartitionParameters(
                 files=shared.Files(
@@ -35,7 +96,7 @@ class UnstructuredAPIProcessor:
                 languages=languages,
             ),
         )
-        
+
         try:
             res = self.client.general.partition(request=req)
             return res.elements
@@ -44,44 +105,195 @@ class UnstructuredAPIProcessor:
             return None
 
 
+def extract_text_layer_from_pdf_document(pdf_path):
+    """
+    Extracts the embedded text layer of a pdf document, without layout detection or OCR
+    :param pdf_path: path to the pdf document
+    :return: list of page texts, empty for pages without a text layer
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        pages = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return pages
+    finally:
+        pdf.close()
+
+
 def extract_text_and_metadata_from_pdf_document_with_images(pdf_path):
     """
-    Extracts text and metadata from a pdf document
+    Extracts text from a pdf document such as the treaty slip. The embedded text layer is used when
+    there is one; hi_res partitioning with OCR is only run for scanned documents.
     :param pdf_path: path to the pdf document
-    :return: tuple of (elements)
+    :return: string containing all text from the PDF
     """
-    elements = partition_pdf(
-        filename=pdf_path,
-        strategy="hi_res",
-        hi_res_model_name="yolox",
-        infer_table_structure=True,
-        chunking_strategy="by_title",
-        max_characters=1000000,
-        new_after_n_chars=1000000,
-        combine_text_under_n_chars=1000000,
+    pages = extract_text_layer_from_pdf_document(pdf_path)
+    text = '\n\n'.join(pages)
+    if text.strip():
+        return text
+    hi_res_texts = partition_pdf_pages(pdf_path, list(range(1, len(pages) + 1)))
+    return '\n\n'.join(hi_res_texts.get(number, '') for number in range(1, len(pages) + 1))
+
+
+def classify_pdf_pages(pdf_path):
+    """
+    Reads the text layer of each page and decides whether the page needs hi_res layout detection:
+    pages without enough embedded text (scans) and table-like pages do, plain text pages do not.
+    :param pdf_path: path to the pdf document
+    :return: list of (page_text, needs_hi_res) tuples in page order
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        pages = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            path_objects = sum(1 for obj in page.get_objects() if obj.type == pdfium_c.FPDF_PAGEOBJ_PATH)
+            page.close()
+
+            numeric_lines = sum(1 for line in text.splitlines() if len(NUMBER_PATTERN.findall(line)) >= 3)
+            needs_hi_res = (
+                len(text.strip()) < MIN_TEXT_LAYER_CHARS
+                or path_objects >= TABLE_MIN_PATH_OBJECTS
+                or numeric_lines >= TABLE_MIN_NUMERIC_LINES
+            )
+            pages.append((text, needs_hi_res))
+        return pages
+    finally:
+        pdf.close()
+
+
+def partition_pdf_pages_hi_res(pdf_path, page_numbers):
+    """
+    Runs hi_res partitioning on selected pages of a pdf document only
+    :param pdf_path: path to the pdf document
+    :param page_numbers: 1-based page numbers to partition
+    :return: dict of page number to the text extracted from that page
+    """
+    source = pdfium.PdfDocument(pdf_path)
+    # Imported here so text-layer-only runs never load the layout model stack (torch, opencv)
+    from unstructured.partition.pdf import partition_pdf
+
+    subset = pdfium.PdfDocument.new()
+    try:
+        subset.import_pages(source, pages=[number - 1 for number in page_numbers])
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            subset_path = f.name
+        subset.save(subset_path)
+    finally:
+        subset.close()
+        source.close()
+
+    try:
+        elements = partition_pdf(
+            filename=subset_path,
+            strategy="hi_res",
+            hi_res_model_name="yolox",
+            infer_table_structure=True,
+        )
+    finally:
+        os.remove(subset_path)
+
+    page_texts = defaultdict(list)
+    for element in elements:
+        if hasattr(element, 'text') and element.text:
+            page_texts[page_numbers[element.metadata.page_number - 1]].append(str(element.text))
+    return {number: '\n\n'.join(texts) for number, texts in page_texts.items()}
+
+
+def init_partition_worker():
+    """
+    Loads the hi_res layout model once when a partition worker process starts
+    """
+    from unstructured_inference.models.base import get_model
+    get_model("yolox")
+
+
+def get_partition_pool():
+    global partition_pool
+    with partition_pool_lock:
+        if partition_pool is None:
+            # spawn rather than fork: the parent runs Streamlit and torch threads
+            partition_pool = ProcessPoolExecutor(
+                max_workers=max(1, PDF_PARTITION_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_partition_worker,
+            )
+        return partition_pool
+
+
+def partition_pdf_pages_hi_res_in_pool(pdf_path, page_numbers, inline_small_jobs=True):
+    """
+    Partitions selected pages with hi_res, split into page ranges that run in parallel worker processes
+    :param pdf_path: path to the pdf document
+    :param page_numbers: 1-based page numbers to partition
+    :param inline_small_jobs: run jobs of a single page range in this process instead of the pool;
+        callers whose pool is already warm pass False so every job uses the loaded model
+    :return: dict of page number to the text extracted from that page
+    """
+    page_ranges = [
+        page_numbers[start:start + PDF_PARTITION_PAGES_PER_TASK]
+        for start in range(0, len(page_numbers), PDF_PARTITION_PAGES_PER_TASK)
+    ]
+    if inline_small_jobs and (PDF_PARTITION_WORKERS <= 1 or len(page_ranges) <= 1):
+        return partition_pdf_pages_hi_res(pdf_path, page_numbers)
+
+    page_texts = {}
+    for range_texts in get_partition_pool().map(partition_pdf_pages_hi_res, [pdf_path] * len(page_ranges), page_ranges):
+        page_texts.update(range_texts)
+    return page_texts
+
+
+def partition_pdf_pages_hi_res_remote(pdf_path, page_numbers):
+    """
+    Sends a hi_res partition job to the partition worker at PARTITION_WORKER_URL
+    :param pdf_path: path to the pdf document, readable by the worker
+    :param page_numbers: 1-based page numbers to partition
+    :return: dict of page number to the text extracted from that page
+    """
+    request = urllib.request.Request(
+        f"{PARTITION_WORKER_URL.rstrip('/')}/partition",
+        data=json.dumps({"pdf_path": os.path.abspath(pdf_path), "page_numbers": page_numbers}).encode(),
+        headers={"Content-Type": "application/json"},
     )
-    text_elements = [str(c.text) for c in elements if hasattr(c, 'text')]
-    return ' '.join(text_elements)
+    with urllib.request.urlopen(request, timeout=PARTITION_WORKER_TIMEOUT) as response:
+        pages = json.loads(response.read())["pages"]
+    return {int(number): text for number, text in pages.items()}
+
+
+def partition_pdf_pages(pdf_path, page_numbers):
+    """
+    Partitions selected pages with hi_res on the warm partition worker when one is configured,
+    otherwise in this process's pool
+    :param pdf_path: path to the pdf document
+    :param page_numbers: 1-based page numbers to partition
+    :return: dict of page number to the text extracted from that page
+    """
+    if PARTITION_WORKER_URL:
+        try:
+            return partition_pdf_pages_hi_res_remote(pdf_path, page_numbers)
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Partition worker at {PARTITION_WORKER_URL} unavailable, partitioning locally: {e}")
+    return partition_pdf_pages_hi_res_in_pool(pdf_path, page_numbers)
 
 
 def extract_text_and_metadata_from_pdf_document(pdf_path):
     """
-    Extracts text from a pdf document
+    Extracts text from a pdf document. Plain text pages are read from the embedded text layer and only
+    scanned or table-like pages go through hi_res layout detection; page texts are stitched back in order.
     :param pdf_path: path to the pdf document
     :return: string containing all text from the PDF
     """
-    elements = partition_pdf(
-        filename=pdf_path,
-        strategy="hi_res",
-        hi_res_model_name="yolox",
-        infer_table_structure=True,
-        chunking_strategy="by_title",
-        max_characters=1000000,
-        new_after_n_chars=1000000,
-        combine_text_under_n_chars=1000000,
-    )
-    text_elements = [str(c.text) for c in elements if hasattr(c, 'text')]
-    return ' '.join(text_elements)
+    pages = classify_pdf_pages(pdf_path)
+    hi_res_pages = [number for number, (_, needs_hi_res) in enumerate(pages, start=1) if needs_hi_res]
+    print(f"{len(hi_res_pages)} of {len(pages)} pages of {pdf_path} need hi_res partitioning")
+    hi_res_texts = partition_pdf_pages(pdf_path, hi_res_pages) if hi_res_pages else {}
+    return '\n\n'.join(hi_res_texts.get(number, text) for number, (text, _) in enumerate(pages, start=1))
 
 def extract_text_and_metadata_from_csv_document(csv_path):
     """
@@ -89,6 +301,7 @@ def extract_text_and_metadata_from_csv_document(csv_path):
     :param csv_path: path to the csv document
     :return: string containing all text from the CSV
     """
+    from unstructured_client.models import shared
     processor = UnstructuredAPIProcessor()
     elements = processor._process_file(csv_path, strategy=shared.Strategy.AUTO)
     
@@ -105,6 +318,8 @@ def extract_elements_and_metadata_from_xlsx_workbook(xlsx_path):
     :param xlsx_path: path to the xlsx workbook
     :return: dict of pandas dataframes with extracted elements and metadata
     """
+    from unstructured.partition.xlsx import partition_xlsx
+
     elements = partition_xlsx(
         filename=xlsx_path,
         infer_table_structure=True,
@@ -115,4 +330,117 @@ def extract_elements_and_metadata_from_xlsx_workbook(xlsx_path):
         if hasattr(element.metadata, 'text_as_html') and element.metadata.text_as_html:
             html_text.append(element.metadata.text_as_html)
 
-    return html_text
\ No newline at end of file
+    return html_text
+
+
+def normalize_header(value):
+    """
+    Normalises a spreadsheet header for matching: lowercase, punctuation removed and the word
+    'limit' dropped, since the bordereaux templates use it inconsistently.
+    :param value: raw header cell value
+    :return: normalised header string
+    """
+    if value is None:
+        return ""
+    words = re.sub(r'[^a-z0-9]+', ' ', str(value).lower()).split()
+    return ' '.join(word for word in words if word != 'limit')
+
+
+def map_claims_borderaux_columns(header_row, group_row=None):
+    """
+    Maps ClaimsBorderaux fields to column indexes using a header row and an optional merged group header row above it.
+    :param header_row: tuple of header cell values
+    :param group_row: tuple of group header cell values (e.g. 'Amount Claimed', 'Amount Paid') or None
+    :return: dict of field name to column index, or None if any field could not be matched
+    """
+    labels = []
+    group = ""
+    for index, cell in enumerate(header_row):
+        if group_row is not None and index < len(group_row) and group_row[index] is not None:
+            group = normalize_header(group_row[index])
+        header = normalize_header(cell)
+        qualified = f"{group} {header}".strip() if header else group
+        labels.append((qualified, header or group))
+
+    column_map = {}
+    used_columns = set()
+    for field, aliases in CLAIMS_BORDERAUX_COLUMNS.items():
+        for alias in aliases:
+            column = next(
+                (index for index, (qualified, bare) in enumerate(labels)
+                 if index not in used_columns and alias in (qualified, bare)),
+                None
+            )
+            if column is not None:
+                column_map[field] = column
+                used_columns.add(column)
+                break
+        else:
+            return None
+    return column_map
+
+
+def convert_claims_borderaux_cell(field, value):
+    """
+    Converts a raw cell value to the type expected by the ClaimsBorderaux field.
+    :param field: ClaimsBorderaux field name
+    :param value: raw cell value
+    :return: converted value
+    """
+    if field in CLAIMS_BORDERAUX_DATE_FIELDS:
+        if isinstance(value, (datetime, date)):
+            return value.strftime('%Y-%m-%d')
+        return str(value).strip() if value is not None else ""
+    if field in CLAIMS_BORDERAUX_TEXT_FIELDS:
+        return str(value).strip() if value is not None else ""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', '').strip())
+    except ValueError:
+        return 0.0
+
+
+def extract_claims_borderaux_from_xlsx_workbook(xlsx_path):
+    """
+    Reads the claims bordereaux rows of an xlsx workbook directly by matching its column headers,
+    without going through the LLM.
+    :param xlsx_path: path to the xlsx workbook
+    :return: dict of ClaimsBorderaux field to column values, or None if no sheet has recognisable claims headers
+    """
+    workbook = load_workbook(filename=xlsx_path, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            rows = worksheet.iter_rows(values_only=True)
+            head = []
+            column_map = None
+            for row in rows:
+                head.append(row)
+                column_map = map_claims_borderaux_columns(row, head[-2] if len(head) > 1 else None)
+                if column_map is not None or len(head) >= HEADER_SEARCH_ROWS:
+                    break
+            if column_map is None:
+                continue
+
+            columns = {field: [] for field in column_map}
+            policy_holder_id = ""
+            for row in rows:
+                values = {
+                    field: row[column] if column < len(row) else None
+                    for field, column in column_map.items()
+                }
+                # Policy holder cells are merged over all of the holder's members
+                if values["policy_holder_id"] is not None:
+                    policy_holder_id = values["policy_holder_id"]
+                if values["member_id"] is None:
+                    continue  # Blank and totals rows
+                values["policy_holder_id"] = policy_holder_id
+                for field, value in values.items():
+                    columns[field].append(convert_claims_borderaux_cell(field, value))
+            print(f"Read {len(columns['member_id'])} claims from sheet '{worksheet.title}'")
+            return columns
+    finally:
+        workbook.close()
+    return None
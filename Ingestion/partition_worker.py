@@ -0,0 +1,78 @@
+"""
+Long-lived local service that keeps the hi_res layout model loaded between uploads.
+
+Start it once per ingest box and point the app at it with PARTITION_WORKER_URL:
+
+    python -m Ingestion.partition_worker --port 8765
+    PARTITION_WORKER_URL=http://127.0.0.1:8765 streamlit run app.py
+
+Jobs are POSTed to /partition as {"pdf_path": ..., "page_numbers": [...]} and queued on the
+worker process pool, whose processes load the model once at startup.
+"""
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Ingestion.ingest import (
+    PDF_PARTITION_WORKERS,
+    get_partition_pool,
+    init_partition_worker,
+    partition_pdf_pages_hi_res_in_pool,
+)
+
+
+class PartitionRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "workers": PDF_PARTITION_WORKERS})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/partition":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            start_time = time.perf_counter()
+            # Always run on the warm pool, never in a request thread where the model is not loaded
+            page_texts = partition_pdf_pages_hi_res_in_pool(job["pdf_path"], job["page_numbers"], inline_small_jobs=False)
+            print(f"Partitioned {len(job['page_numbers'])} pages of {job['pdf_path']} in {time.perf_counter() - start_time:.2f}s")
+            self.send_json(200, {"pages": {str(number): text for number, text in page_texts.items()}})
+        except Exception as e:
+            print(f"Error partitioning job: {e}")
+            self.send_json(500, {"error": str(e)})
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def warm_up_partition_pool():
+    # Workers are started on demand, so one initialisation job per worker starts all of them
+    pool = get_partition_pool()
+    for future in [pool.submit(init_partition_worker) for _ in range(max(1, PDF_PARTITION_WORKERS))]:
+        future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local hi_res PDF partition worker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    warm_up_partition_pool()
+    print(f"Loaded layout model in {PDF_PARTITION_WORKERS} workers in {time.perf_counter() - start_time:.2f}s")
+
+    server = ThreadingHTTPServer((args.host, args.port), PartitionRequestHandler)
+    print(f"Partition worker listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,257 @@
 import streamlit as st
 from datetime import datetime
-from data_loader import extract_treaty_information_from_documents
-from services import process_claims
-from models import ClaimsBorderaux, TreatyStatementInformation, Treaty
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import os
-import uuid
-import hashlib
-import redis
-import json
-import pandas as pd
-
-# Define directory for saving uploaded files
-UPLOAD_DIR = "uploaded_files"
-
-REDIS_URL = os.getenv("REDIS_URL")
-CACHE_TTL = 432000
-
-redis_client = redis.StrictRedis.from_url(REDIS_URL)
-
-def get_file_hash(file_object):
-    if file_object is None:
-        return None
-    file_object.seek(0)
-    file_content = file_object.read()
-    file_object.seek(0)
-    return hashlib.md5(file_content).hexdigest()
-
-def get_cache_key(pdf_file, excel_file, treaty_file):
-    pdf_hash = get_file_hash(pdf_file)
-    excel_hash = get_file_hash(excel_file)
-    treaty_hash = get_file_hash(treaty_file)
-    combined_hash = f"{pdf_hash}-{excel_hash}-{treaty_hash}"
-    return hashlib.md5(combined_hash.encode()).hexdigest()
-
-def cache_result(key, result):
-    redis_client.setex(key, CACHE_TTL, json.dumps(result))
-
-def get_cached_result(key):
-    result = redis_client.get(key)
-    if result:
-        return json.loads(result.decode())
-    return None
+import time
+from cache import get_documents_key, get_results_cache_key, cache_result, get_cached_result
+from jobs import JOB_POLL_INTERVAL, JOB_STEPS, get_job, load_job_documents, submit_job, workers_alive
+from uploads import save_upload
+
+# Define directory for saving uploaded files, stored under the hash of their contents
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_files")
 
 # Ensure the directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Seconds the page follows a job before asking to be refreshed
+JOB_FOLLOW_TIMEOUT = float(os.getenv("JOB_FOLLOW_TIMEOUT", "1800"))
+
+
+# Shown in place of the limit figures when the treaty's limits could not be extracted
+LIMIT_UNAVAILABLE = "Unavailable"
+
+
+def format_limit_figure(value, format_spec=",.2f"):
+    return LIMIT_UNAVAILABLE if value is None else format(value, format_spec)
+
+
+def format_exceeds_limit(exceeds_limit):
+    return LIMIT_UNAVAILABLE if exceeds_limit is None else ("Yes" if exceeds_limit else "No")
+
+
+def render_report(results):
+    st.success("Claims Processing Complete")
+
+    st.header("Claims Processing Report")
+
+    if "periods" in results:
+        render_periods_report(results)
+    else:
+        render_period_report(results)
+
+
+def render_periods_report(results):
+    """
+    Shows an overview of every analysed period, then each period's report in its own tab.
+    """
+    import pandas as pd
+    import plotly.graph_objects as go
+
+    periods = results["periods"]
+    if not periods:
+        st.warning("No claims with a valid treatment date" + (f" in {results['year']}" if results.get('year') else "") + ".")
+        return
+
+    labels = [f"Q{period['quarter']} {period['year']}" for period in periods]
+
+    st.header("Periods Overview")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric(label="Total Claims that should be paid", value=f"{results['total_claims_paid']:,.2f}")
+    with col2:
+        st.metric(label="Periods Exceeding Limit", value=format_limit_figure(
+            None if results['exceeds_limit'] is None else sum(period['exceeds_limit'] for period in periods), "d"
+        ))
+
+    st.table(pd.DataFrame({
+        'Period': labels,
+        'Total Claims Paid': [period['total_claims_paid'] for period in periods],
+        'Claim Limit': [format_limit_figure(period['claim_limit']) for period in periods],
+        'Limit Usage (%)': [format_limit_figure(period['limit_usage']) for period in periods],
+        'Exceeds Limit': [format_exceeds_limit(period['exceeds_limit']) for period in periods],
+        'Claim Frequency (per day)': [period['claim_frequency'] for period in periods],
+        'Fraud Flags': [sum(len(v) for v in period['fraud_checks'].values()) for period in periods],
+    }))
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=labels, y=[period['total_claims_paid'] for period in periods], name="Claims that should be paid"))
+    if results['exceeds_limit'] is not None:
+        fig.add_trace(go.Scatter(x=labels, y=[period['claim_limit'] for period in periods], name="Claim Limit", mode="lines+markers"))
+    fig.update_layout(height=400)
+    st.plotly_chart(fig, use_container_width=True)
+
+    for tab, period in zip(st.tabs(labels), periods):
+        with tab:
+            render_period_report(period)
+
+
+def render_limit_charts(results):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(rows=1, cols=2, specs=[[{'type':'domain'}, {'type':'domain'}]])
+
+    # Pie chart for claims vs limit
+    fig.add_trace(go.Pie(labels=['Claims that should be paid', 'Remaining Limit'], 
+                        values=[results['total_claims_paid'], max(0, results['claim_limit'] - results['total_claims_paid'])],
+                        name="Claims vs Limit"), 1, 1)
+
+    # Gauge chart for limit usage
+    limit_usage = min(results['limit_usage'] or 0, 100)
+    fig.add_trace(go.Indicator(
+        mode = "gauge+number",
+        value = limit_usage,
+        title = {'text': "Limit Usage"},
+        gauge = {'axis': {'range': [None, 100]},
+                'steps': [
+                    {'range': [0, 60], 'color': "lightgreen"},
+                    {'range': [60, 80], 'color': "yellow"},
+                    {'range': [80, 100], 'color': "red"}],
+                'threshold': {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': 100}}), 1, 2)
+
+    fig.update_layout(height=400)
+    st.plotly_chart(fig, use_container_width=True)
+
+
+def render_period_report(results):
+    # The analysis and charting stacks are only imported once there is a report to show,
+    # keeping the script that Streamlit re-runs on every interaction light
+    import pandas as pd
+
+    # Quarter Info
+    st.header("Period Information")
+    st.info(f"**Quarter**: {results['quarter']}" + (f" {results['year']}" if results.get('year') else ""))
+
+    # Financial Summary
+    st.header("Financial Summary")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric(label="Total Claims that should be paid", value=f"{results['total_claims_paid']:,.2f}")
+    with col2:
+        st.metric(label="Claim Limit", value=format_limit_figure(results['claim_limit']))
+    with col3:
+        if results['exceeds_limit'] is None:
+            st.metric(label="Exceeds Limit", value=LIMIT_UNAVAILABLE)
+        else:
+            st.metric(label="Exceeds Limit", value="Yes" if results['exceeds_limit'] else "No",
+                    delta="Exceeds" if results['exceeds_limit'] else "Within Limit",
+                    delta_color="inverse")
+
+    # Claims Overview
+    st.header("Claims Overview")
+    if results['claim_limit'] is None:
+        st.warning("The treaty's limits could not be extracted from the contract, so the claim limit is unavailable.")
+    else:
+        render_limit_charts(results)
+
+    # Fraud Checks
+
+    st.header("Fraud Detection Results")
+    fraud_checks = results['fraud_checks']
+
+    if any(fraud_checks.values()):
+        for check, data in fraud_checks.items():
+            if data:
+                st.subheader(check.replace('_', ' ').title())
+                if check == 'multiple_claims_same_day':
+                    for date, claims in data:
+                        st.warning(f"**Date**: {date}")
+                        st.table(pd.DataFrame(claims))
+                elif check == 'frequent_claimants':
+                    st.table(pd.DataFrame(data, columns=['Member ID', 'Claim Count']))
+                else:
+                    st.table(pd.DataFrame(data))
+    else:
+        st.success("No fraudulent activities detected.")
+
+    if results.get('fraud_rule_seconds'):
+        st.caption("Fraud rule evaluation time: " + ", ".join(
+            f"{rule.replace('_', ' ')} {seconds * 1000:.1f}ms" for rule, seconds in results['fraud_rule_seconds'].items()
+        ))
+
+    # Additional Statistics
+    st.header("Additional Statistics")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric(label="Claim Frequency (per day)", value=f"{results['claim_frequency']:.2f}")
+    with col2:
+        st.metric(label="Average Claim Amount", value=f"{results['average_claim_amount']:,.2f}")
+
+    # Summary of the Report
+    st.header("Report Summary")
+    st.markdown(f"""
+    - **Total Claims Paid**: {results['total_claims_paid']:,.2f}
+    - **Claim Limit**: {format_limit_figure(results['claim_limit'])}
+    - **Exceeds Limit**: {format_exceeds_limit(results['exceeds_limit'])}
+    - **Fraudulent Activities Detected**: {sum(len(v) for v in fraud_checks.values())}
+    - **Claim Frequency**: {results['claim_frequency']:.2f} claims per day
+    - **Average Claim Amount**: {results['average_claim_amount']:,.2f}
+    """)
+
+
+def follow_job(job_id):
+    """
+    Shows a job's progress until it finishes, then its report. Processing runs in the job worker,
+    so leaving or refreshing the page does not stop it; the job id in the URL resumes following it.
+    """
+    job = get_job(job_id)
+    if job is None:
+        st.error(f"Unknown job {job_id}")
+        return
+
+    progress_bar = st.progress(0.0)
+    status_text = st.empty()
+    deadline = time.monotonic() + JOB_FOLLOW_TIMEOUT
+    while job["status"] in ("queued", "running"):
+        if not workers_alive():
+            # A job whose worker died is queued again by the next worker to start
+            progress_bar.empty()
+            status_text.empty()
+            st.error("No job worker is running. Start one with `python jobs.py`; "
+                     "this job stays queued and the page picks it up again when refreshed.")
+            return
+        if time.monotonic() > deadline:
+            st.warning(f"The job is still {job['status']} after {JOB_FOLLOW_TIMEOUT / 60:.0f} minutes. "
+                       "It keeps running in the worker; refresh the page to follow it again.")
+            return
+        finished = ", ".join(step for step in JOB_STEPS if step in job["steps"])
+        progress_bar.progress(job["progress"])
+        status_text.text(f"{job['stage']}..." + (f" (finished: {finished})" if finished else ""))
+        time.sleep(JOB_POLL_INTERVAL)
+        job = get_job(job_id)
+
+    if job["status"] == "failed":
+        progress_bar.empty()
+        status_text.empty()
+        st.error(f"An error occurred: {job['error']}")
+        st.write("Please check the job worker logs for more details.")
+        return
+
+    progress_bar.progress(1.0)
+    status_text.text("Processing complete!")
+    render_report(job["results"])
+
+
+def get_extracted_documents(documents_key):
+    """
+    Returns the documents the worker extracted for these uploads, kept for the session so that
+    switching the quarter or year only re-runs the analysis, in this process.
+    :return: (treaty, bordereaux, treaty statement), or None if they have not been extracted yet
+    """
+    extracted_documents = st.session_state.get("extracted_documents")
+    if extracted_documents is not None and extracted_documents[0] == documents_key:
+        return extracted_documents[1:]
+    documents = load_job_documents(documents_key)
+    if documents is not None:
+        st.session_state["extracted_documents"] = (documents_key, *documents)
+    return documents
+
+
+def analyse_extracted_documents(documents, quarter, year):
+    from claims_engine import analyse_claims
+    treaty_object, borderaux_data, treaty_statement_information = documents
+    return analyse_claims(borderaux_data.claims_borderaux, treaty_statement_information, treaty_object, quarter, year)
+
+
 # Streamlit App Implementation
 st.title('Claims Processing Application')
 
@@ -72,159 +277,55 @@ treaty_pdf_with_images = st.file_uploader("Upload the Treaty Slip PDF", type=["p
 
 # Step 2: Select quarter and year
 st.header("Select Quarter")
-quarter = st.selectbox('Select the quarter:', [1, 2, 3, 4])
+# All quarters analyses every (year, quarter) period found in the claims in one run
+quarter = st.selectbox('Select the quarter:', [1, 2, 3, 4, None],
+                       format_func=lambda q: "All quarters" if q is None else str(q))
+year = st.selectbox('Select the year:', [None] + list(range(datetime.now().year, 2009, -1)),
+                    format_func=lambda y: "All years" if y is None else str(y))
 
 # Step 3: Process claims
 if st.button("Process Claims"):
     if pdf_directory is not None and excel_file is not None and treaty_pdf_with_images is not None:
         try:
-            # Create a progress bar
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-
-            # Update progress
-            def update_progress(progress, status):
-                progress_bar.progress(progress)
-                status_text.text(status)
-
-            # Generate cache keys based on file contents
-            update_progress(0.1, "Generating cache keys...")
-            cache_key = get_cache_key(pdf_directory, excel_file, treaty_pdf_with_images)
+            # Save the uploads in one pass each; their content hashes key the caches and identical
+            # re-uploads are stored once
+            pdf_hash, pdf_path = save_upload(pdf_directory, UPLOAD_DIR, ".pdf")
+            excel_hash, excel_path = save_upload(excel_file, UPLOAD_DIR, ".xlsx")
+            treaty_hash, treaty_path = save_upload(treaty_pdf_with_images, UPLOAD_DIR, ".pdf")
+            documents_key = get_documents_key([pdf_hash, excel_hash, treaty_hash])
+            cache_key = get_results_cache_key(documents_key, quarter, year)
             print(f"Cache key: {cache_key}")
-            # pdf_key = get_cache_key(pdf_directory.getvalue())
-            # excel_key = get_cache_key(excel_file.getvalue())
-            # treaty_key = get_cache_key(treaty_pdf_with_images.getvalue())
-            
-            # combined_key = get_cache_key(f"{pdf_key}-{excel_key}-{treaty_key}")
 
             # Check if results are already cached
             cached_result = get_cached_result(cache_key)
-            
+
+            documents = None if cached_result else get_extracted_documents(documents_key)
+
             if cached_result:
-                update_progress(0.9, "Retrieved cached results...")
-                results = cached_result
-            else:
-                # Save uploaded files in a permanent directory
-                update_progress(0.2, "Saving uploaded files...")
-                unique_id = str(uuid.uuid4())
-                pdf_path = os.path.join(UPLOAD_DIR, f"contract_{unique_id}.pdf")
-                excel_path = os.path.join(UPLOAD_DIR, f"borderaux_{unique_id}.xlsx")
-                treaty_path = os.path.join(UPLOAD_DIR, f"treaty_{unique_id}.pdf")
-
-                # Write the uploaded files to the specified paths
-                with open(pdf_path, "wb") as f:
-                    f.write(pdf_directory.getvalue())
-                with open(excel_path, "wb") as f:
-                    f.write(excel_file.getvalue())
-                with open(treaty_path, "wb") as f:
-                    f.write(treaty_pdf_with_images.getvalue())
-
-                # Extract treaty information
-                update_progress(0.4, "Extracting information from the documents...")
-                treaty_object, borderaux_data, treaty_statement_information = extract_treaty_information_from_documents(pdf_path, excel_path, treaty_path)
-
-                # Process claims
-                update_progress(0.7, "Processing claims...")
-                results = process_claims(borderaux_data.claims_borderaux, treaty_statement_information, treaty_object, quarter)
-
-                # Cache the results
+                st.query_params.clear()
+                render_report(cached_result)
+            elif documents is not None:
+                # The documents were already extracted, so another period is analysed right here
+                st.query_params.clear()
+                results = analyse_extracted_documents(documents, quarter, year)
                 cache_result(cache_key, results)
-
-                # Clean up temporary files
-                os.remove(pdf_path)
-                os.remove(excel_path)
-                os.remove(treaty_path)
-
-            # Display results as a report
-            update_progress(0.9, "Generating report...")
-
-            st.success("Claims Processing Complete")
-
-            st.header("Claims Processing Report")
-
-            # Quarter Info
-            st.header("Period Information")
-            st.info(f"**Quarter**: {results['quarter']}")
-
-            # Financial Summary
-            st.header("Financial Summary")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric(label="Total Claims that should be paid", value=f"{results['total_claims_paid']:,.2f}")
-            with col2:
-                st.metric(label="Claim Limit", value=f"{results['claim_limit']:,.2f}")
-            with col3:
-                st.metric(label="Exceeds Limit", value="Yes" if results['exceeds_limit'] else "No", 
-                        delta="Exceeds" if results['exceeds_limit'] else "Within Limit",
-                        delta_color="inverse")
-
-            # Claims Overview
-            st.header("Claims Overview")
-            fig = make_subplots(rows=1, cols=2, specs=[[{'type':'domain'}, {'type':'domain'}]])
-            
-            # Pie chart for claims vs limit
-            fig.add_trace(go.Pie(labels=['Claims that should be paid', 'Remaining Limit'], 
-                                values=[results['total_claims_paid'], max(0, results['claim_limit'] - results['total_claims_paid'])],
-                                name="Claims vs Limit"), 1, 1)
-            
-            # Gauge chart for limit usage
-            limit_usage = min(results['total_claims_paid'] / results['claim_limit'] * 100, 100)
-            fig.add_trace(go.Indicator(
-                mode = "gauge+number",
-                value = limit_usage,
-                title = {'text': "Limit Usage"},
-                gauge = {'axis': {'range': [None, 100]},
-                        'steps': [
-                            {'range': [0, 60], 'color': "lightgreen"},
-                            {'range': [60, 80], 'color': "yellow"},
-                            {'range': [80, 100], 'color': "red"}],
-                        'threshold': {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': 100}}), 1, 2)
-
-            fig.update_layout(height=400)
-            st.plotly_chart(fig, use_container_width=True)
-
-            # Fraud Checks
-            st.header("Fraud Detection Results")
-            fraud_checks = results['fraud_checks']
-            
-            if any(fraud_checks.values()):
-                for check, data in fraud_checks.items():
-                    if data:
-                        st.subheader(check.replace('_', ' ').title())
-                        if check == 'multiple_claims_same_day':
-                            for date, claims in data:
-                                st.warning(f"**Date**: {date}")
-                                st.table(pd.DataFrame(claims))
-                        elif check == 'frequent_claimants':
-                            st.table(pd.DataFrame(data, columns=['Member ID', 'Claim Count']))
-                        else:
-                            st.table(pd.DataFrame(data))
+                render_report(results)
             else:
-                st.success("No fraudulent activities detected.")
-
-            # Additional Statistics
-            st.header("Additional Statistics")
-            col1, col2 = st.columns(2)
-            with col1:
-                st.metric(label="Claim Frequency (per day)", value=f"{results['claim_frequency']:.2f}")
-            with col2:
-                st.metric(label="Average Claim Amount", value=f"{results['average_claim_amount']:,.2f}")
-
-            # Summary of the Report
-            st.header("Report Summary")
-            st.markdown(f"""
-            - **Total Claims Paid**: {results['total_claims_paid']:,.2f}
-            - **Claim Limit**: {results['claim_limit']:,.2f}
-            - **Exceeds Limit**: {'Yes' if results['exceeds_limit'] else 'No'}
-            - **Fraudulent Activities Detected**: {sum(len(v) for v in fraud_checks.values())}
-            - **Claim Frequency**: {results['claim_frequency']:.2f} claims per day
-            - **Average Claim Amount**: {results['average_claim_amount']:,.2f}
-            """)
-            # Complete the progress bar
-            update_progress(1.0, "Processing complete!")
-            
+                # Processing is queued for the job worker (python jobs.py), so the page only polls.
+                # A job already queued or running for the same documents is followed instead
+                job_id = submit_job(
+                    {"contract": pdf_path, "borderaux": excel_path, "treaty": treaty_path}, documents_key, quarter, year
+                )
+                job = get_job(job_id)
+                if job is not None and (job["quarter"], job["year"]) != (quarter, year):
+                    st.info("These documents are already being processed for another period. Once that job "
+                            "finishes, process them again to analyse this period from the extracted documents.")
+                st.query_params["job"] = job_id
         except Exception as e:
             st.error(f"An error occurred: {e}")
             st.write("Please check the server logs for more details.")
     else:
-        st.warning("Please upload all required documents.")
\ No newline at end of file
+        st.warning("Please upload all required documents.")
+
+if "job" in st.query_params:
+    follow_job(st.query_params["job"])
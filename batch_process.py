@@ -0,0 +1,144 @@
+"""
+Processes every claim packet in a directory without the Streamlit app.
+
+    python batch_process.py uploaded_files --quarter 3 --year 2020 --workers 4 --output batch_results
+
+Without --quarter every (year, quarter) period in the claims is analysed in one pass.
+
+A packet is a contract_<id>.pdf, borderaux_<id>.xlsx and treaty_<id>.pdf triplet. Each packet's
+results are written to <output>/<id>.json and a summary with throughput to <output>/summary.json.
+Exits with status 1 when any packet is incomplete or fails.
+"""
+import argparse
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from cache import get_documents_key, get_file_hash_from_path, get_results_cache_key, cache_result, get_cached_result
+
+PACKET_FILE_PATTERN = re.compile(r"^(?P<kind>contract|borderaux|treaty)_(?P<id>.+)\.(?P<extension>pdf|xlsx)$")
+PACKET_FILE_EXTENSIONS = {"contract": "pdf", "borderaux": "xlsx", "treaty": "pdf"}
+
+
+def find_packets(directory: str):
+    """
+    Groups the files of a directory into packets by id.
+    :return: (dict of id to {kind: path} for complete packets, dict of id to missing kinds for incomplete ones)
+    """
+    packets = defaultdict(dict)
+    for file_name in sorted(os.listdir(directory)):
+        match = PACKET_FILE_PATTERN.match(file_name)
+        if match and PACKET_FILE_EXTENSIONS[match["kind"]] == match["extension"]:
+            packets[match["id"]][match["kind"]] = os.path.join(directory, file_name)
+
+    complete, incomplete = {}, {}
+    for packet_id, files in packets.items():
+        missing = [kind for kind in PACKET_FILE_EXTENSIONS if kind not in files]
+        if missing:
+            incomplete[packet_id] = missing
+        else:
+            complete[packet_id] = files
+    return complete, incomplete
+
+
+def process_packet(packet_id: str, files: dict, quarter, year, extractor, output_dir: str) -> dict:
+    # Imported here so that listing packets and argument errors do not load the extraction stack
+    from data_loader import extract_treaty_information_from_documents
+    from claims_engine import analyse_claims
+
+    start_time = time.perf_counter()
+    documents_key = get_documents_key([get_file_hash_from_path(files[kind]) for kind in PACKET_FILE_EXTENSIONS])
+    cache_key = get_results_cache_key(documents_key, quarter, year)
+    results = get_cached_result(cache_key)
+    claim_count = None
+    if results is None:
+        treaty_object, borderaux_data, treaty_statement_information = extract_treaty_information_from_documents(
+            files["contract"], files["borderaux"], files["treaty"], extractor=extractor
+        )
+        claim_count = len(borderaux_data.claims_borderaux)
+        results = analyse_claims(
+            borderaux_data.claims_borderaux, treaty_statement_information, treaty_object, quarter, year
+        )
+        cache_result(cache_key, results)
+
+    with open(os.path.join(output_dir, f"{packet_id}.json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    return {
+        "id": packet_id,
+        "status": "ok",
+        "seconds": round(time.perf_counter() - start_time, 2),
+        "cached": claim_count is None,
+        "claims": claim_count,
+        "total_claims_paid": results["total_claims_paid"],
+        "claim_limit": results.get("claim_limit"),
+        "exceeds_limit": results["exceeds_limit"],
+        "periods": [(period["year"], period["quarter"]) for period in results.get("periods", [])] or None,
+    }
+
+
+def run_packet(packet_id: str, files: dict, quarter, year, extractor, output_dir: str) -> dict:
+    start_time = time.perf_counter()
+    try:
+        summary = process_packet(packet_id, files, quarter, year, extractor, output_dir)
+    except Exception as e:
+        summary = {"id": packet_id, "status": "failed", "seconds": round(time.perf_counter() - start_time, 2), "error": str(e)}
+    print(f"Packet {packet_id}: {summary['status']} in {summary['seconds']:.2f}s")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", help="directory of contract_/borderaux_/treaty_<id> files")
+    parser.add_argument("--quarter", type=int, default=None, choices=[1, 2, 3, 4], help="analyse every period when omitted")
+    parser.add_argument("--year", type=int, default=None, help="only analyse claims of this year")
+    parser.add_argument("--workers", type=int, default=2, help="packets processed at the same time")
+    parser.add_argument("--output", default="batch_results", help="directory for the results files")
+    args = parser.parse_args()
+
+    packets, incomplete = find_packets(args.directory)
+    for packet_id, missing in incomplete.items():
+        print(f"Skipping incomplete packet {packet_id}: missing {', '.join(missing)}")
+    print(f"Processing {len(packets)} packets with {args.workers} workers")
+    os.makedirs(args.output, exist_ok=True)
+
+    # One extractor, and so one set of models and one rate limiter, is shared by all packets
+    from data_loader import get_document_extractor
+    extractor = get_document_extractor() if packets else None
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(run_packet, packet_id, files, args.quarter, args.year, extractor, args.output)
+            for packet_id, files in packets.items()
+        ]
+        packet_summaries = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start_time
+
+    succeeded = [summary for summary in packet_summaries if summary["status"] == "ok"]
+    claims = sum(summary["claims"] or 0 for summary in succeeded)
+    summary = {
+        "quarter": args.quarter,
+        "year": args.year,
+        "packets": len(packets),
+        "succeeded": len(succeeded),
+        "failed": len(packets) - len(succeeded),
+        "incomplete": incomplete,
+        "seconds": round(elapsed, 2),
+        "packets_per_minute": round(len(succeeded) / elapsed * 60, 2) if elapsed else None,
+        "claims_extracted": claims,
+        "claims_per_second": round(claims / elapsed, 2) if elapsed else None,
+        "results": packet_summaries,
+    }
+    with open(os.path.join(args.output, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"{len(succeeded)} of {len(packets)} packets succeeded in {elapsed:.2f}s "
+          f"({summary['packets_per_minute']} packets/min, {summary['claims_per_second']} claims/s)")
+    raise SystemExit(1 if incomplete or len(succeeded) < len(packets) else 0)
+
+
+if __name__ == "__main__":
+    main()
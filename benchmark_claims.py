@@ -0,0 +1,107 @@
+"""
+Compares services.process_claims with the vectorised claims engine on a synthetic bordereaux,
+and per-quarter analysis with the single-pass analysis of every period.
+
+    python benchmark_claims.py --claims 200000
+"""
+import argparse
+import gc
+import json
+import random
+import time
+from datetime import date, timedelta
+from models import ClaimsBorderaux, ClaimsBorderauxColumns, TreatyStatementInformation, Treaty, TreatyDetail
+from services import process_claims, LEGACY_FRAUD_RULES
+from claims_engine import load_claims_frame, process_claims_frame, process_claims_by_period
+
+
+def generate_claims(count: int, members: int, seed: int = 0):
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    claims = []
+    for _ in range(count):
+        treatment_date = (start + timedelta(days=rng.randrange(366))).isoformat()
+        amount = float(rng.randrange(1, 40) * 1000 if rng.random() < 0.05 else rng.randrange(1000, 300000))
+        claims.append(ClaimsBorderaux(
+            policy_holder_id=f"HOLDER {rng.randrange(members // 20 + 1)}",
+            member_id=f"MEMBER {rng.randrange(members)}",
+            start_date_of_cover="2020-01-01",
+            end_date_of_cover="2020-12-31",
+            date_of_claim_treatment_date=treatment_date,
+            date_of_payment_approval_date=treatment_date,
+            outpatient_per_family=amount,
+            inpatient_per_family=0.0,
+            dental_per_individual=0.0,
+            optic_per_individual=0.0,
+            spectacle_frame_per_individual=0.0,
+            death_and_total_permanent_disability_cover_per_individual_claims=0.0,
+            total_claims_paid=amount,
+        ))
+    return claims
+
+
+def timed(function, *args):
+    # Earlier results stay alive, so collect first to keep their garbage out of the timing
+    gc.collect()
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--claims", type=int, default=100000, help="number of synthetic claims")
+    parser.add_argument("--members", type=int, default=5000, help="number of distinct members")
+    parser.add_argument("--quarter", type=int, default=3, choices=[1, 2, 3, 4])
+    args = parser.parse_args()
+
+    claims = generate_claims(args.claims, args.members)
+    statement = TreatyStatementInformation(
+        reinsured="", treaty="", period="", total_premium=40880330.4,
+        total_claims=0.0, share_balance=0.0, share_percentage=0.0
+    )
+    contract = Treaty(
+        reinsured="", start_date=date(2020, 1, 1), end_date=date(2020, 12, 31), treaty_type="",
+        business_covered=[], territorial_scope="", reinsurer_participations=[],
+        treaty_details=[TreatyDetail(limits=[], retention_percentage=0.0, maximum_cession=60.0)],
+    )
+
+    expected, loop_time = timed(process_claims, claims, statement, contract, args.quarter)
+    columns, validate_time = timed(ClaimsBorderauxColumns.from_records, claims)
+    frame, load_time = timed(load_claims_frame, columns)
+    results, engine_time = timed(process_claims_frame, frame, statement, contract, args.quarter)
+
+    # Rule timings are only reported by the engine, and rules other than the legacy ones are only
+    # evaluated by it, so the comparison covers the legacy rules
+    rule_seconds = results.pop('fraud_rule_seconds')
+    engine_only_rules = [name for name in results['fraud_checks'] if name not in LEGACY_FRAUD_RULES]
+    compared = {**results, 'fraud_checks': {
+        name: checks for name, checks in results['fraud_checks'].items() if name in LEGACY_FRAUD_RULES
+    }}
+    same = json.dumps(expected, sort_keys=True) == json.dumps(compared, sort_keys=True)
+
+    # A yearly picture: each quarter filtered separately, against one pass over all periods
+    quarterly, quarterly_time = timed(
+        lambda: [process_claims_frame(frame, statement, contract, quarter, 2020) for quarter in range(1, 5)]
+    )
+    by_period, by_period_time = timed(process_claims_by_period, frame, statement, contract, 2020)
+    for period_results in quarterly + by_period['periods']:
+        period_results.pop('fraud_rule_seconds')
+    same_periods = json.dumps(quarterly, sort_keys=True) == json.dumps(by_period['periods'], sort_keys=True)
+    print(f"{args.claims} claims, quarter {args.quarter}")
+    print(f"process_claims:        {loop_time:.3f}s")
+    print(f"bulk validation:       {validate_time:.3f}s")
+    print(f"load_claims_frame:     {load_time:.3f}s")
+    print(f"process_claims_frame:  {engine_time:.3f}s ({loop_time / engine_time:.1f}x)")
+    for rule_name, seconds in rule_seconds.items():
+        print(f"  {rule_name}: {seconds:.3f}s")
+    print(f"identical results:     {same}")
+    if engine_only_rules:
+        print(f"  not compared (engine only): {', '.join(engine_only_rules)}")
+    print(f"4 quarters separately: {quarterly_time:.3f}s")
+    print(f"process_claims_by_period: {by_period_time:.3f}s ({quarterly_time / by_period_time:.1f}x)")
+    print(f"identical periods:     {same_periods}")
+
+
+if __name__ == "__main__":
+    main()
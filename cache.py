@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, TypeVar
+import redis
+from dotenv import load_dotenv, find_dotenv
+
+
+_ = load_dotenv(find_dotenv())
+
+REDIS_URL = os.getenv("REDIS_URL")
+CACHE_TTL = 432000
+
+# Redis connection pool size and timeouts in seconds; after a failure Redis is skipped for
+# REDIS_RETRY_INTERVAL seconds and the local cache is used on its own
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1"))
+REDIS_RETRY_INTERVAL = float(os.getenv("REDIS_RETRY_INTERVAL", "30"))
+
+# Entries kept in the in-process cache, and the zlib level of stored values
+LOCAL_CACHE_SIZE = int(os.getenv("LOCAL_CACHE_SIZE", "256"))
+CACHE_COMPRESSION_LEVEL = int(os.getenv("CACHE_COMPRESSION_LEVEL", "6"))
+
+# Read size used when hashing and copying files, and the number of file hashes remembered
+HASH_CHUNK_SIZE = 1024 * 1024
+FILE_HASH_CACHE_SIZE = 1024
+
+# Bumped when the claims analysis changes, so results computed before are not served
+RESULTS_VERSION = "2"
+
+T = TypeVar("T")
+
+
+def compress_value(value: str) -> bytes:
+    return zlib.compress(value.encode(), CACHE_COMPRESSION_LEVEL)
+
+
+def decompress_value(data: bytes) -> str:
+    try:
+        return zlib.decompress(data).decode()
+    except zlib.error:
+        # Entries written before values were compressed
+        return data.decode()
+
+
+class LocalCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiry.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return data
+
+    def set(self, key, data, ttl: int):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+class CacheClient:
+    """
+    Cache of string values stored zlib-compressed in Redis, with a local LRU in front of it.
+    Reads are served locally when possible; when Redis is unreachable it is skipped for
+    REDIS_RETRY_INTERVAL seconds and the local cache is used on its own, so the app keeps working.
+    :param redis_client: Redis client (any redis-py compatible client, e.g. fakeredis), or None to cache locally only
+    :param local_cache_size: number of entries kept in process
+    """
+
+    def __init__(self, redis_client=None, local_cache_size: int = LOCAL_CACHE_SIZE):
+        self.redis_client = redis_client
+        self.local_cache = LocalCache(local_cache_size)
+        self.redis_retry_at = 0.0
+
+    def redis_available(self) -> bool:
+        return self.redis_client is not None and time.monotonic() >= self.redis_retry_at
+
+    def mark_redis_unavailable(self, error: redis.RedisError):
+        print(f"Redis unavailable, using the local cache for {REDIS_RETRY_INTERVAL:.0f}s: {error}")
+        self.redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+
+    def get_many(self, keys: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Reads several keys, fetching those missing locally from Redis in one round trip.
+        :return: dict of key to value, None for missing keys
+        """
+        found = {key: self.local_cache.get(key) for key in keys}
+        missing = [key for key, data in found.items() if data is None]
+        if missing and self.redis_available():
+            try:
+                for key, data in zip(missing, self.redis_client.mget(missing)):
+                    if data is not None:
+                        found[key] = data
+                        self.local_cache.set(key, data, CACHE_TTL)
+            except redis.RedisError as e:
+                self.mark_redis_unavailable(e)
+        return {key: decompress_value(data) if data is not None else None for key, data in found.items()}
+
+    def set_many(self, values: Dict[str, str], ttl: int = CACHE_TTL):
+        """
+        Stores several values, writing them to Redis in one pipelined round trip.
+        """
+        compressed = {key: compress_value(value) for key, value in values.items()}
+        for key, data in compressed.items():
+            self.local_cache.set(key, data, ttl)
+        if compressed and self.redis_available():
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                for key, data in compressed.items():
+                    pipeline.setex(key, ttl, data)
+                pipeline.execute()
+            except redis.RedisError as e:
+                self.mark_redis_unavailable(e)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key])[key]
+
+    def set(self, key: str, value: str, ttl: int = CACHE_TTL):
+        self.set_many({key: value}, ttl)
+
+
+def create_redis_client() -> Optional[redis.StrictRedis]:
+    # The pool connects on first use, so an unreachable server only shows up as a cache miss
+    if not REDIS_URL:
+        print("REDIS_URL is not set, caching in process only")
+        return None
+    connection_pool = redis.ConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=30,
+    )
+    return redis.StrictRedis(connection_pool=connection_pool)
+
+
+@lru_cache(maxsize=None)
+def get_cache_client() -> CacheClient:
+    # Created on first use, so importing this module neither reads the Redis settings nor logs
+    return CacheClient(create_redis_client())
+
+# Hashes of files on disk keyed by path, size and modification time, so a file is read once
+# however many stages key their cache entries on it
+file_hash_cache = LocalCache(FILE_HASH_CACHE_SIZE)
+
+
+def new_file_hash():
+    return hashlib.blake2b(digest_size=16)
+
+
+def get_file_signature(file_path: str):
+    file_stat = os.stat(file_path)
+    return os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns
+
+
+def remember_file_hash(file_path: str, file_hash: str):
+    file_hash_cache.set(get_file_signature(file_path), file_hash, CACHE_TTL)
+
+
+def get_file_hash_from_path(file_path: str) -> str:
+    signature = get_file_signature(file_path)
+    cached = file_hash_cache.get(signature)
+    if cached is not None:
+        return cached
+
+    file_hash = new_file_hash()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    file_hash_cache.set(signature, file_hash.hexdigest(), CACHE_TTL)
+    return file_hash.hexdigest()
+
+
+def get_documents_key(file_hashes: List[str]) -> str:
+    # Identifies a set of documents by the hashes of their contents
+    return hashlib.blake2b("-".join(file_hashes).encode(), digest_size=16).hexdigest()
+
+
+def get_results_cache_key(documents_key, quarter, year):
+    # Results depend on the analysed period as well as the documents; a quarter of None is every period
+    return f"results:{RESULTS_VERSION}:{documents_key}:{quarter}:{year}"
+
+
+def cache_result(key, result):
+    get_cache_client().set(key, json.dumps(result))
+
+
+def get_cached_result(key):
+    result = get_cache_client().get(key)
+    if result:
+        return json.loads(result)
+    return None
+
+
+def get_stage_cache_key(stage: str, version: str, file_hash: str) -> str:
+    return f"stage:{stage}:{version}:{file_hash}"
+
+
+def get_cached_stages(stages: List[str], version: str, file_hash: str) -> Dict[str, Optional[str]]:
+    """
+    Reads the stored outputs of several stages run on the same file in one round trip.
+    :return: dict of stage to serialized output, None for stages not cached
+    """
+    keys = {stage: get_stage_cache_key(stage, version, file_hash) for stage in stages}
+    values = get_cache_client().get_many(list(keys.values()))
+    return {stage: values[key] for stage, key in keys.items()}
+
+
+def cache_stages(outputs: Dict[str, str], version: str, file_hash: str):
+    """
+    Stores the serialized outputs of several stages run on the same file in one round trip.
+    """
+    get_cache_client().set_many({get_stage_cache_key(stage, version, file_hash): output for stage, output in outputs.items()})
+
+
+def cached_stage(
+    stage: str,
+    version: str,
+    file_path: str,
+    extract: Callable[[str], T],
+    serialize: Callable[[T], str],
+    deserialize: Callable[[str], T],
+) -> T:
+    """
+    Runs an extraction stage on a single input file, reusing the stored output when the same
+    file content has already been processed by the same version of the stage.
+    Cache outages are logged and the stage is run uncached.
+    """
+    file_hash = get_file_hash_from_path(file_path)
+    cached = get_cached_stages([stage], version, file_hash)[stage]
+    if cached:
+        print(f"Stage '{stage}' loaded from cache")
+        return deserialize(cached)
+
+    value = extract(file_path)
+    cache_stages({stage: serialize(value)}, version, file_hash)
+    return value
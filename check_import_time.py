@@ -0,0 +1,71 @@
+"""
+Checks that importing the Streamlit app stays within its start-up budget and does not pull in
+the extraction stacks, which are only imported once a processing run starts.
+
+    python check_import_time.py --budget 1.5
+
+The same check covers the modules the job and batch workers import, whose langchain, Google AI
+and Unstructured stacks are only loaded once an extractor is built or a document is partitioned:
+
+    python check_import_time.py --module data_loader --budget 1.5
+
+Exits with status 1 when the budget is exceeded or a heavy module is imported.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules that must only be imported when processing starts
+LAZY_MODULES = ["torch", "unstructured", "langchain", "langchain_core", "google.generativeai", "data_loader", "claims_engine"]
+
+
+def measure_import(module: str):
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr}")
+
+    timings = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        if cumulative_us.isdigit():
+            timings[name] = int(cumulative_us) / 1e6
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget", type=float, default=1.5, help="maximum cumulative import time in seconds")
+    args = parser.parse_args()
+
+    timings = measure_import(args.module)
+    total = timings.get(args.module)
+    if total is None:
+        print(f"FAIL: import {args.module} does not appear in the import timings")
+        sys.exit(1)
+    # The checked module itself is allowed, e.g. data_loader when it is the one being imported
+    lazy_modules = [lazy for lazy in LAZY_MODULES if lazy != args.module]
+    heavy = [name for name in timings if any(name == lazy or name.startswith(f"{lazy}.") for lazy in lazy_modules)]
+
+    print(f"import {args.module}: {total:.3f}s (budget {args.budget:.3f}s)")
+    for name, seconds in sorted(timings.items(), key=lambda item: item[1], reverse=True)[1:11]:
+        print(f"  {seconds:.3f}s  {name}")
+
+    failed = False
+    if total > args.budget:
+        print(f"FAIL: import {args.module} exceeds the {args.budget:.3f}s budget")
+        failed = True
+    if heavy:
+        print(f"FAIL: modules that should be imported lazily were imported: {', '.join(sorted(heavy)[:10])}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+from typing import List, Optional
+import pandas as pd
+from utils import get_quarter_days
+from models import ClaimsBorderauxColumns, TreatyStatementInformation, Treaty
+from claims_frame import claims_to_frame
+from fraud_rules import evaluate_fraud_rules, get_fraud_rule_inputs
+
+
+def get_claim_limit(contract: Treaty, total_premium: float) -> Optional[float]:
+    """
+    Claim limit of the treaty: its maximum cession percentage of the total premium.
+    :return: the limit, or None when the treaty's limits could not be extracted
+    """
+    if not contract.treaty_details or contract.treaty_details[0].maximum_cession is None:
+        return None
+    return contract.treaty_details[0].maximum_cession / 100 * total_premium
+
+
+def get_period_days(quarter: int, years: List[int]) -> int:
+    # Days covered by a quarter across the given years, counting leap days
+    return sum(get_quarter_days(quarter, year) for year in years)
+
+
+def summarise_claims(claims_in_period: pd.DataFrame, treaty_statement_info: TreatyStatementInformation, contract: Treaty, quarter: int, year: Optional[int], period_days: int):
+    """
+    Computes the results dict of one period from the claims that fall in it.
+    :param period_days: number of days in the period, for the claim frequency
+    """
+    amounts = claims_in_period['total_claims_paid']
+
+    total_claims_paid = float(amounts.sum())
+    total_premium = treaty_statement_info.total_premium
+
+    # Without the treaty's limits the limit checks are reported as unavailable (None)
+    claim_limit = get_claim_limit(contract, total_premium)
+    exceeds_limit = total_claims_paid > claim_limit if claim_limit is not None else None
+
+    fraud_results, fraud_rule_seconds = evaluate_fraud_rules(claims_in_period, total_premium)
+
+    # Calculate additional statistics
+    claim_count = len(claims_in_period)
+    claim_frequency = claim_count / period_days if period_days else 0
+    average_claim_amount = total_claims_paid / claim_count if claim_count else 0
+
+    return {
+        'quarter': quarter,
+        'year': year,
+        'total_claims_paid': total_claims_paid,
+        'claim_limit': claim_limit,
+        'exceeds_limit': bool(exceeds_limit) if exceeds_limit is not None else None,
+        'limit_usage': total_claims_paid / claim_limit * 100 if claim_limit else None,
+        'fraud_checks': fraud_results,
+        'fraud_rule_seconds': fraud_rule_seconds,
+        'claim_frequency': claim_frequency,
+        'average_claim_amount': average_claim_amount,
+    }
+
+
+def process_claims_frame(frame: pd.DataFrame, treaty_statement_info: TreatyStatementInformation, contract: Treaty, quarter: int, year: Optional[int] = None):
+    """
+    Vectorised equivalent of services.process_claims over a frame built by load_claims_frame.
+    Produces the same results dict.
+    """
+    in_period = (frame['claim_quarter'] == quarter).fillna(False)
+    if year is not None:
+        in_period &= (frame['claim_year'] == year).fillna(False)
+    claims_in_quarter = frame[in_period]
+
+    # Without a year the period is that quarter of every year with claims in it
+    years = [year] if year is not None else claims_in_quarter['claim_year'].unique().tolist()
+    return summarise_claims(
+        claims_in_quarter, treaty_statement_info, contract, quarter, year, get_period_days(quarter, years)
+    )
+
+
+def process_claims_by_period(frame: pd.DataFrame, treaty_statement_info: TreatyStatementInformation, contract: Treaty, year: Optional[int] = None):
+    """
+    Analyses every (year, quarter) period with claims in a single pass over the frame, instead of
+    filtering it once per quarter.
+    :param year: only analyse the periods of this year
+    :return: dict with the results dict of each period in date order under 'periods', and the
+        totals over all of them
+    """
+    if year is not None:
+        frame = frame[(frame['claim_year'] == year).fillna(False)]
+
+    periods = [
+        summarise_claims(
+            claims_in_period, treaty_statement_info, contract, int(claim_quarter), int(claim_year),
+            get_quarter_days(int(claim_quarter), int(claim_year))
+        )
+        for (claim_year, claim_quarter), claims_in_period in frame.groupby(['claim_year', 'claim_quarter'], sort=True)
+    ]
+    return {
+        'quarter': None,
+        'year': year,
+        'total_claims_paid': sum(period['total_claims_paid'] for period in periods),
+        'exceeds_limit': (
+            None if any(period['exceeds_limit'] is None for period in periods)
+            else any(period['exceeds_limit'] for period in periods)
+        ),
+        'periods': periods,
+    }
+
+
+def load_claims_frame(claims_borderaux: ClaimsBorderauxColumns) -> pd.DataFrame:
+    # Only the inputs of the enabled fraud rules are encoded for them
+    return claims_to_frame(claims_borderaux, get_fraud_rule_inputs())
+
+
+def process_claims_vectorized(claims_borderaux: ClaimsBorderauxColumns, treaty_statement_info: TreatyStatementInformation, contract: Treaty, quarter: int, year: Optional[int] = None):
+    return process_claims_frame(load_claims_frame(claims_borderaux), treaty_statement_info, contract, quarter, year)
+
+
+def process_claims_by_period_vectorized(claims_borderaux: ClaimsBorderauxColumns, treaty_statement_info: TreatyStatementInformation, contract: Treaty, year: Optional[int] = None):
+    return process_claims_by_period(load_claims_frame(claims_borderaux), treaty_statement_info, contract, year)
+
+
+def analyse_claims(claims_borderaux: ClaimsBorderauxColumns, treaty_statement_info: TreatyStatementInformation, contract: Treaty, quarter: Optional[int], year: Optional[int] = None):
+    """
+    Analyses one quarter, or every period when no quarter is given.
+    """
+    if quarter is None:
+        return process_claims_by_period_vectorized(claims_borderaux, treaty_statement_info, contract, year)
+    return process_claims_vectorized(claims_borderaux, treaty_statement_info, contract, quarter, year)
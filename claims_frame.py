@@ -0,0 +1,63 @@
+"""
+Columnar claims frame shared by the claims engine and the fraud rules.
+"""
+from typing import Iterable, List
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from dates import ISO_DATE_FORMAT
+from models import ClaimsBorderaux, ClaimsBorderauxColumns
+
+CLAIM_COLUMNS = list(ClaimsBorderaux.model_fields)
+CLAIM_AMOUNT_COLUMNS = [
+    name for name, field in ClaimsBorderaux.model_fields.items() if field.annotation is float
+]
+CLAIM_TEXT_COLUMNS = [column for column in CLAIM_COLUMNS if column not in CLAIM_AMOUNT_COLUMNS]
+
+
+def parse_date_column(values: pd.Series) -> pd.Series:
+    """
+    Parses a column of dates already normalised to ISO by ClaimsBorderauxColumns.
+    Unrecognised values (including 'N/A') become NaT.
+    """
+    return pd.to_datetime(values, format=ISO_DATE_FORMAT, errors='coerce')
+
+
+def claims_to_frame(claims_borderaux: ClaimsBorderauxColumns, inputs: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Loads claims into a compact columnar frame: float64 amounts, text and the treatment date
+    parsed once into a datetime64 column, with the year and quarter it falls in.
+    :param inputs: columns the fraud rules read. Text columns among them are encoded as
+        categoricals for grouping; the others are only carried through to the flagged claims,
+        so they are kept as plain values and not encoded.
+    """
+    inputs = set(inputs)
+    frame = pd.DataFrame({
+        **{
+            column: pd.Categorical(getattr(claims_borderaux, column)) if column in inputs
+            else pd.Series(getattr(claims_borderaux, column), dtype=object)
+            for column in CLAIM_TEXT_COLUMNS
+        },
+        **{column: np.asarray(getattr(claims_borderaux, column), dtype='float64') for column in CLAIM_AMOUNT_COLUMNS},
+    }, columns=CLAIM_COLUMNS)
+    frame['claim_date'] = parse_date_column(frame['date_of_claim_treatment_date'].astype(str))
+    # Nullable integers, so claims without a valid date have no period
+    frame['claim_year'] = frame['claim_date'].dt.year.astype('Int64')
+    frame['claim_quarter'] = frame['claim_date'].dt.quarter.astype('Int64')
+    return frame
+
+
+def frame_to_claim_dicts(frame: pd.DataFrame) -> List[dict]:
+    # Column-wise tolist() is much cheaper than DataFrame.to_dict('records') for large flagged sets
+    columns = [frame[column].tolist() for column in CLAIM_COLUMNS]
+    return [dict(zip(CLAIM_COLUMNS, row)) for row in zip(*columns)]
+
+
+def group_claim_dicts(frame: pd.DataFrame, key: str) -> dict:
+    """
+    Groups a frame's claims, as dicts, by one of its columns in order of first appearance.
+    """
+    groups = defaultdict(list)
+    for group_key, claim in zip(frame[key].tolist(), frame_to_claim_dicts(frame)):
+        groups[group_key].append(claim)
+    return groups
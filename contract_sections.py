@@ -0,0 +1,163 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+# Rough size of a Gemini token in characters of English contract text; used for budgeting and logging
+CHARS_PER_TOKEN = 4
+
+# Lines that start a new clause in slips and contract wordings:
+# "Commission: ...", "CLAIMS AUDIT ...", "Article 1: ..." and "1.2 Period of Application"
+CLAUSE_HEADING_PATTERNS = [
+    re.compile(r"^(?:Article|ARTICLE|Clause|CLAUSE|Appendix|APPENDIX)\s+\S+"),
+    re.compile(r"^\d+\.\d+(?:\.\d+)*\s+[A-Z][^.:]{0,60}"),
+    re.compile(r"^[A-Z][A-Za-z’'/&() -]{1,40}:"),
+    re.compile(r"^[A-Z]{2,}(?:[ -][A-Z]{2,})*(?=\s|$)"),
+]
+MIN_CAPITALS_HEADING_LENGTH = 4
+# Number of preceding clauses searched for a repeated heading
+LIST_LOOKBACK_SECTIONS = 4
+
+# Words and phrases that mark the clauses each treaty field is read from; fields without an
+# entry are matched on their own name
+TREATY_FIELD_KEYWORDS = {
+    "reinsured": ["reinsured", "cedant", "reassured"],
+    "start_date": ["period", "inception", "effective", "commencement"],
+    "end_date": ["period", "expiry", "inclusive", "cancellation"],
+    "treaty_type": ["type", "quota share", "surplus", "excess of loss"],
+    "business_covered": ["business covered", "class of business", "cover"],
+    "territorial_scope": ["territorial scope", "territory", "territories"],
+    "treaty_details": ["treaty detail", "limit", "retention", "maximum cession", "category", "sum insured"],
+    "exclusions": ["exclusion", "excluded"],
+    "original_gross_rate": ["rates", "original gross rate", "ogr"],
+    "commission": ["commission", "loss ratio"],
+    "special_conditions": ["special conditions", "special acceptance"],
+    "cash_loss_limit": ["cash loss"],
+    "accounts_settlement": ["accounts settlement", "settlement", "quarterly accounts"],
+    "currency": ["currency"],
+    "taxes": ["taxes", "levies"],
+    "law_and_jurisdiction": ["law and jurisdiction", "jurisdiction"],
+    "arbitration": ["arbitration", "seat of arbitration"],
+    "age_limit": ["age limit", "aged", "exit age"],
+    "several_liability": ["several liability"],
+    "intermediary": ["intermediary", "brokerage", "broker"],
+    "reinsurer_participations": ["participation", "reinsurer:", "leading reinsurer", "our order"],
+}
+
+# A keyword in a clause heading counts this many times a keyword in its body, and body matches are
+# capped so that long boilerplate articles do not outrank the short slip clauses
+HEADING_MATCH_WEIGHT = 5
+MAX_BODY_MATCHES = 2
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def match_clause_heading(line: str) -> str:
+    """
+    Returns the heading that starts a line, or an empty string when the line continues the current clause.
+    """
+    stripped = line.strip()
+    for pattern in CLAUSE_HEADING_PATTERNS:
+        match = pattern.match(stripped)
+        if match:
+            heading = match.group(0).strip()
+            if pattern is CLAUSE_HEADING_PATTERNS[-1] and len(heading) < MIN_CAPITALS_HEADING_LENGTH:
+                continue
+            return heading
+    return ""
+
+
+def split_contract_sections(text: str) -> List[Tuple[str, str]]:
+    """
+    Splits contract text into clauses at their headings. A "Label:" heading that repeats within the
+    last few clauses starts another entry of a list, such as the reinsurers and participations on a
+    signing page, so the clauses from its first occurrence are kept together as one.
+    :param text: contract text
+    :return: list of (heading, text) tuples in document order; text before the first heading has an empty heading
+    """
+    # Each section is [heading, lines, headings of the clauses merged into it]
+    sections = [["", [], set()]]
+    for line in text.splitlines():
+        line_heading = match_clause_heading(line)
+        if line_heading:
+            recent = sections[-LIST_LOOKBACK_SECTIONS:]
+            repeated = [
+                position for position, section in enumerate(recent)
+                if line_heading.endswith(":") and line_heading in section[2]
+            ]
+            if repeated:
+                first = len(sections) - len(recent) + repeated[0]
+                for section in sections[first + 1:]:
+                    sections[first][1].extend(section[1])
+                    sections[first][2].update(section[2])
+                del sections[first + 1:]
+            elif sections[-1][1]:
+                sections.append([line_heading, [], {line_heading}])
+            else:
+                sections[-1][0] = line_heading
+                sections[-1][2].add(line_heading)
+        sections[-1][1].append(line)
+    return [(heading, "\n".join(lines)) for heading, lines, _ in sections if lines]
+
+
+def get_field_keywords(field_names: Iterable[str]) -> Dict[str, List[str]]:
+    return {name: TREATY_FIELD_KEYWORDS.get(name, [name.replace("_", " ")]) for name in field_names}
+
+
+def score_section(section: Tuple[str, str], keywords: List[str]) -> int:
+    heading, text = section
+    heading, text = heading.lower(), text.lower()
+    heading_matches = sum(heading.count(keyword) for keyword in keywords)
+    body_matches = sum(text.count(keyword) for keyword in keywords)
+    return HEADING_MATCH_WEIGHT * heading_matches + min(body_matches, MAX_BODY_MATCHES)
+
+
+def select_contract_sections(sections: List[Tuple[str, str]], field_keywords: Dict[str, List[str]], token_budget: int, sections_per_field: int) -> List[int]:
+    """
+    Picks the clauses most relevant to the treaty fields within a token budget.
+    Every field's best clause is taken before any field's second best, so no field is starved by
+    another's long clauses; the opening clause, which names the parties, is always considered first.
+    :return: indices of the selected sections in document order
+    """
+    ranked_by_field = []
+    for keywords in field_keywords.values():
+        scores = [(score_section(section, keywords), index) for index, section in enumerate(sections)]
+        ranked = sorted((item for item in scores if item[0] > 0), key=lambda item: (-item[0], item[1]))
+        ranked_by_field.append([index for _, index in ranked[:sections_per_field]])
+
+    candidates = [0] + [ranked[rank] for rank in range(sections_per_field) for ranked in ranked_by_field if rank < len(ranked)]
+    selected, used_tokens = set(), 0
+    for index in candidates:
+        if index in selected:
+            continue
+        section_tokens = estimate_tokens(sections[index][1])
+        if used_tokens + section_tokens > token_budget:
+            continue
+        selected.add(index)
+        used_tokens += section_tokens
+    return sorted(selected)
+
+
+def compact_contract_text(text: str, field_names: Iterable[str], token_budget: int, sections_per_field: int) -> str:
+    """
+    Reduces contract text to the clauses relevant to the given treaty fields, keeping their order.
+    Text that already fits the budget is returned unchanged.
+    :param text: contract text
+    :param field_names: treaty fields to be extracted from the text
+    :param token_budget: maximum estimated tokens of contract text to send
+    :param sections_per_field: number of best-matching clauses kept for each field
+    :return: compacted contract text
+    """
+    text_tokens = estimate_tokens(text)
+    if text_tokens <= token_budget:
+        print(f"Contract text is {text_tokens} estimated tokens, within the {token_budget} token budget")
+        return text
+
+    sections = split_contract_sections(text)
+    selected = select_contract_sections(sections, get_field_keywords(field_names), token_budget, sections_per_field)
+    compacted = "\n".join(sections[index][1] for index in selected)
+    print(
+        f"Contract text compacted from {text_tokens} to {estimate_tokens(compacted)} estimated tokens "
+        f"({len(selected)} of {len(sections)} clauses)"
+    )
+    return compacted
@@ -1,49 +1,87 @@
 import os
 import sys
 import json
-import google.generativeai as genai
 import re
-import base64
+import time
 import getpass
-from datetime import datetime
-from typing import List, Optional, Any, Tuple
-from tqdm.auto import tqdm
-from pydantic import Field
-from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain.output_parsers import StructuredOutputParser, ResponseSchema
-from langchain_core.language_models import BaseLLM
-from langchain_core.callbacks.manager import CallbackManagerForLLMRun
-from langchain.output_parsers import StructuredOutputParser, ResponseSchema
-from langchain_core.outputs import LLMResult, Generation
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.schema.messages import HumanMessage, SystemMessage
-from langchain_core.exceptions import OutputParserException
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterator, List, Optional, Tuple
+from functools import lru_cache, partial
+from pydantic import ValidationError
 from dotenv import load_dotenv, find_dotenv
 from bs4 import BeautifulSoup
 from models import (
     Treaty, TreatyDetail, CategoryLimit, Exclusion, Commission, SpecialCondition, 
     LawAndJurisdiction, Arbitration, AgeLimit, Liability, Intermediary, 
-    ReinsurerParticipation, PremiumBorderaux, ClaimsBorderaux, BorderauxInformation, 
+    ReinsurerParticipation, ClaimsBorderaux, ClaimsBorderauxColumns, BorderauxInformation, 
     TreatyStatementInformation
 )
 from Ingestion.ingest import (
     extract_text_and_metadata_from_pdf_document, 
-    extract_text_and_metadata_from_csv_document, 
     extract_elements_and_metadata_from_xlsx_workbook, 
-    extract_text_and_metadata_from_pdf_document_with_images
+    extract_text_and_metadata_from_pdf_document_with_images,
+    extract_claims_borderaux_from_xlsx_workbook,
+    normalize_header,
+    CLAIMS_BORDERAUX_COLUMNS,
 )
+from cache import cached_stage, cache_stages, get_cached_stages, get_file_hash_from_path
+from contract_sections import compact_contract_text
+from json_stream import JsonArrayStreamParser
+from dates import parse_date as parse_date_string
 
 
 # Load environment
 sys.path.append("../..")
 _ = load_dotenv(find_dotenv())
 
-# Prompt user for API key if not set
-if "GOOGLE_API_KEY" not in os.environ:
-    os.environ["GOOGLE_API_KEY"] = getpass.getpass("Enter your Google AI API key: ")
 
-genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+@lru_cache(maxsize=None)
+def configure_genai():
+    # Done on first use rather than at import so importing this module has no side effects
+    # Prompt user for API key if not set
+    if "GOOGLE_API_KEY" not in os.environ:
+        os.environ["GOOGLE_API_KEY"] = getpass.getpass("Enter your Google AI API key: ")
+
+    import google.generativeai as genai
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+
+# Bordereaux LLM extraction: body rows per prompt, leading rows checked for a header to repeat in every chunk and concurrent requests
+BORDERAUX_CHUNK_ROWS = int(os.getenv("BORDERAUX_CHUNK_ROWS", "50"))
+BORDERAUX_CHUNK_HEADER_ROWS = int(os.getenv("BORDERAUX_CHUNK_HEADER_ROWS", "2"))
+BORDERAUX_LLM_CONCURRENCY = int(os.getenv("BORDERAUX_LLM_CONCURRENCY", "4"))
+
+# Versions of each cached extraction stage; bump a version when its output changes so stale entries are ignored
+EXTRACTOR_VERSIONS = {
+    "contract_text": "2",
+    "treaty": "4",
+    "borderaux": "4",
+    "treaty_statement": "3",
+}
+
+# Estimated tokens of contract text sent in the treaty prompt, and clauses kept per treaty field
+# when a longer contract is compacted
+TREATY_PROMPT_TOKEN_BUDGET = int(os.getenv("TREATY_PROMPT_TOKEN_BUDGET", "6000"))
+TREATY_SECTIONS_PER_FIELD = int(os.getenv("TREATY_SECTIONS_PER_FIELD", "2"))
+
+# Treaty fields are extracted in independent groups, each with its own sub-schema, prompt and
+# retries; attempts are per group, on top of the model wrapper's retries of transient API errors
+TREATY_FIELD_GROUPS = {
+    "parties": ["reinsured", "start_date", "end_date", "treaty_type", "business_covered", "territorial_scope"],
+    "limits": ["treaty_details"],
+    "exclusions": ["exclusions", "special_conditions"],
+    "commission": ["original_gross_rate", "commission", "cash_loss_limit", "accounts_settlement", "currency", "taxes"],
+    "legal_clauses": ["law_and_jurisdiction", "arbitration", "age_limit", "several_liability"],
+    "participations": ["intermediary", "reinsurer_participations"],
+}
+TREATY_GROUP_ATTEMPTS = int(os.getenv("TREATY_GROUP_ATTEMPTS", "2"))
+
+# Total premium used when none can be read from the treaty slip
+DEFAULT_TOTAL_PREMIUM = 40880330.4
+
+# Run the contract, bordereaux and treaty slip extractions concurrently
+EXTRACTION_PARALLEL = os.getenv("EXTRACTION_PARALLEL", "true").lower() == "true"
 
 treaty_schema = {
     "type": "object",
@@ -159,6 +197,20 @@ treaty_schema = {
 }
 
 
+def get_treaty_group_padding(field_names: List[str]) -> dict:
+    # Value each key of a field group gets when the model leaves it out. The group's parser
+    # requires all of its keys, while the schema lets the model omit the optional ones
+    return {name: [] if treaty_schema["properties"][name]["type"] == "array" else None for name in field_names}
+
+
+def get_treaty_group_schema(field_names: List[str]) -> dict:
+    return {
+        "type": "object",
+        "properties": {name: treaty_schema["properties"][name] for name in field_names},
+        "required": [name for name in treaty_schema["required"] if name in field_names],
+    }
+
+
 borderaux_schema = {
   "type": "object",
   "properties": {
@@ -231,105 +283,20 @@ borderaux_schema = {
   "required": ["premium_borderaux", "claims_borderaux"]
 }
 
-class GoogleAIModelWrapper(BaseLLM):
-    model: Any = Field(description="Google AI model instance")
-
-    class Config:
-        arbitrary_types_allowed = True
-
-    def __init__(self, model: Any, **kwargs: Any):
-        super().__init__(model=model, **kwargs)
-
-    def _call(
-        self,
-        prompt: str,
-        stop: Optional[List[str]] = None,
-        run_manager: Optional[CallbackManagerForLLMRun] = None,
-        **kwargs: Any,
-    ) -> str:
-        response = self.model.generate_content(prompt, safety_settings=[
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"}
-        ])
-        
-        if response.candidates:
-            if response.candidates[0].content.parts:
-                text = response.candidates[0].content.parts[0].text
-                try:
-                    json_obj = json.loads(text)
-                    for key in treaty_schema["required"]:
-                        if key not in json_obj:
-                            if key == "exclusions":
-                                json_obj[key] = []
-                            elif key == "reinsurer_participations":
-                                json_obj[key] = []
-                            else:
-                                json_obj[key] = None
-                    return json.dumps(json_obj)
-                except json.JSONDecodeError:
-                    return text
-            else:
-                return json.dumps({
-                    "error": "Response content is empty.",
-                    "prompt_feedback": str(response.prompt_feedback) if response.prompt_feedback else "No feedback available",
-                    "candidates": [str(c) for c in response.candidates]
-                })
-        else:
-            return json.dumps({
-                "error": "No candidates in response.",
-                "prompt_feedback": str(response.prompt_feedback) if response.prompt_feedback else "No feedback available"
-            })
-
-    @property
-    def _llm_type(self) -> str:
-        return "google_ai"
-
-    def _generate(
-        self,
-        prompts: List[str],
-        stop: Optional[List[str]] = None,
-        run_manager: Optional[CallbackManagerForLLMRun] = None,
-        **kwargs: Any,
-    ) -> LLMResult:
-        generations = []
-        for prompt in prompts:
-            response = self._call(prompt, stop=stop, run_manager=run_manager, **kwargs)
-            generations.append([Generation(text=response)])
-        return LLMResult(generations=generations)
-
-def parse_date_(date_string):
-    date_formats = ['%Y-%m-%d %H:%M:%S', '%d/%m/%Y', '%Y-%m-%d']
-    for fmt in date_formats:
-        try:
-            return datetime.strptime(date_string.strip(), fmt).strftime('%Y-%m-%d')
-        except ValueError:
-            continue
-    return None  # Return None if no format matches
-
-def remove_ordinal_suffix(date_str):
-    # This regex removes 'st', 'nd', 'rd', 'th' from the date string
-    return re.sub(r'(\d+)(st|nd|rd|th)', r'\1', date_str)
-
 # Convert date strings to datetime objects
 def parse_date(date_str):
-    clean_date_str = remove_ordinal_suffix(date_str)
-    
-    try:
-        return datetime.strptime(clean_date_str, "%d %B %Y")
-    except ValueError:
-        try:
-            return datetime.strptime(clean_date_str, "%Y-%m-%d")
-        except ValueError:
-            raise ValueError(f"Date format not recognized for: {date_str}")
+    parsed = parse_date_string(date_str)
+    if parsed is None:
+        raise ValueError(f"Date format not recognized for: {date_str}")
+    return parsed
 
 # Map the JSON data to the Treaty Pydantic model
 def map_json_to_treaty(data):
+    # Fields of a failed field group are missing; missing dates are left as None rather than made up
     treaty = Treaty(
         reinsured=data.get("reinsured", ""),
-        start_date=parse_date(data.get("start_date", "")),
-        end_date=parse_date(data.get("end_date", "")),
+        start_date=parse_date(data["start_date"]) if data.get("start_date") else None,
+        end_date=parse_date(data["end_date"]) if data.get("end_date") else None,
         treaty_type=data.get("treaty_type", ""),
         business_covered=data.get("business_covered", []),
         territorial_scope=data.get("territorial_scope", ""),
@@ -358,6 +325,30 @@ def map_json_to_treaty(data):
     return treaty
 
 
+def extract_contract_text(pdf_file_path: str) -> str:
+    text = extract_text_and_metadata_from_pdf_document(pdf_file_path)
+    if not text.strip():
+        raise ValueError(f"No text could be extracted from {pdf_file_path}")
+    return text
+
+
+def validate_treaty_group(group: str, output: dict) -> dict:
+    """
+    Keeps a field group's own fields from the model output and checks that they map onto the treaty.
+    Raises ValueError when the group is empty or does not validate, so it is retried rather than cached.
+    """
+    # Only the group's own fields are taken from the model output; fields left as None (padded or
+    # not found) are dropped, so the treaty falls back to its defaults for them
+    group_output = {name: output[name] for name in TREATY_FIELD_GROUPS[group] if output.get(name) is not None}
+    if not any(value not in (None, "", [], {}) for value in group_output.values()):
+        raise ValueError(f"Treaty field group '{group}' came back empty")
+    try:
+        map_json_to_treaty(group_output)
+    except (ValidationError, TypeError, ValueError) as e:
+        raise ValueError(f"Treaty field group '{group}' does not validate: {e}")
+    return group_output
+
+
 def extract_treaty_info(text: str) -> TreatyStatementInformation:
     # Extract reinsured
     reinsured_match = re.search(r'Reinsured\s*:\s*(.+)', text)
@@ -394,87 +385,81 @@ def extract_treaty_info(text: str) -> TreatyStatementInformation:
         share_percentage=share_percentage
     )
 
-# Function to handle extraction and mapping from all document types
-def extract_treaty_information_from_documents(
-    pdf_file_path: str, excel_file: str, treaty_pdf_with_images_path: str
-) -> Tuple[Treaty, BorderauxInformation, TreatyStatementInformation]:
-
-    # Initialize treaty schema output parser
-    print("Starting treaty_information extraction")
-    response_schemas = [ResponseSchema(name=key, description=f"The {key} of the treaty") for key, value in treaty_schema["properties"].items()]
-    output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
+# Known bordereaux header texts, and their leading words (merged group headers such as "amount paid")
+BORDERAUX_HEADER_TERMS = {
+    " ".join(alias.split()[:length])
+    for aliases in CLAIMS_BORDERAUX_COLUMNS.values() for alias in aliases
+    for length in range(2, len(alias.split()) + 1)
+}
 
-    # Define prompt template for treaty extraction
-    prompt_template = """
-    You are a treaty information extraction assistant specializing in reinsurance documents. Your task is to analyze the provided document text and extract relevant information into a structured format according to the specified schema.
 
-    The following text has been extracted from a reinsurance treaty document. Use this text to extract the required information:
-    {document_text}
+def is_header_cell_value(text: str) -> bool:
+    # Figures and dates belong to claim rows, never to a header
+    value = text.replace(",", "").strip()
+    try:
+        float(value)
+        return False
+    except ValueError:
+        return parse_date_string(value) is None
 
-    {format_instructions}
 
-    Please ensure that your response strictly adheres to the JSON format specified above.
+def is_header_row(row) -> bool:
     """
-    prompt = PromptTemplate(
-        template=prompt_template,
-        input_variables=["document_text"],
-        partial_variables={"format_instructions": output_parser.get_format_instructions()}
-    )
-    google_model = genai.GenerativeModel('gemini-1.5-flash',
-        generation_config={
-            "response_mime_type": "application/json",
-            "response_schema": treaty_schema
-        }
+    Tells a header row from a claim row by its content: no figures or dates, and at least one
+    cell naming a known bordereaux column.
+    """
+    cells = [cell.get_text(strip=True) for cell in row.find_all(["td", "th"])]
+    cells = [cell for cell in cells if cell]
+    return (
+        bool(cells)
+        and all(is_header_cell_value(cell) for cell in cells)
+        and any(normalize_header(cell) in BORDERAUX_HEADER_TERMS for cell in cells)
     )
 
-    wrapped_model = GoogleAIModelWrapper(model=google_model)
-    # Chain to process document text
-    rag_chain = (
-        {
-            "document_text": RunnablePassthrough(),
-        }
-        | prompt
-        | wrapped_model
-        | output_parser
-    )
 
-    # Process treaty PDF documents
-    documents_text = ""
-    try:
-        documents_text = extract_text_and_metadata_from_pdf_document(pdf_file_path) + "\n\n"
-        print("Documents text extracted")
-    except Exception as e:
-        print(f"Error processing {pdf_file_path}: {str(e)}")
-    
-    try:
-        output = rag_chain.invoke(documents_text)
-        print("Treaty output extracted")
-        treaty_object = map_json_to_treaty(output)
-    except Exception as e:
-        print(f"An error occurred while processing the treaty information: {e}")
-        print("Returning a default Treaty object")
-        treaty_object = Treaty(
-            reinsured="",
-            start_date=datetime.now(),
-            end_date=datetime.now(),
-            treaty_type="",
-            business_covered=[],
-            territorial_scope="",
-            treaty_details=[],
-            reinsurer_participations=[]
-        )
+def split_html_table_into_chunks(html_table: str, chunk_rows: int, header_rows: int, default_header_html: str = "") -> Tuple[str, List[Tuple[str, List[str]]]]:
+    """
+    Splits an HTML table into chunks of at most chunk_rows body rows, each carrying the table header.
+    The header is the table's <thead>, or else those of its first header_rows rows that read as
+    headers. A table without one, such as a later part of a sheet split at blank rows, is given
+    default_header_html and all of its rows are claims.
+    Returns the table's header html and its (header_html, row_htmls) chunks.
+    """
+    table = BeautifulSoup(html_table, "html.parser").find("table")
+    if table is None:
+        return default_header_html, [(default_header_html, [html_table])]
 
-    # Process Excel file (Premium and Claims Borderaux)
-    html_text = extract_elements_and_metadata_from_xlsx_workbook(excel_file)
-    print("Extracted HTML texts")
-    
-    borderaux_schemas = []
-    for key, value in borderaux_schema["properties"].items():
-        borderaux_schemas.append(ResponseSchema(name=key, description=f"The {key} of the borderaux"))
+    thead = table.find("thead")
+    if thead is not None:
+        header = thead.find_all("tr")
+        body = [row for row in table.find_all("tr") if row.find_parent("thead") is None]
+    else:
+        rows = table.find_all("tr")
+        header_count = 0
+        while header_count < min(header_rows, len(rows)) and is_header_row(rows[header_count]):
+            header_count += 1
+        header, body = rows[:header_count], rows[header_count:]
 
-    borderaux_output_parser = StructuredOutputParser.from_response_schemas(borderaux_schemas)
+    header_html = "".join(str(row) for row in header) or default_header_html
+    body = [str(row) for row in body if row.get_text(strip=True)]
+    return header_html, [(header_html, body[start:start + chunk_rows]) for start in range(0, len(body), chunk_rows)]
 
-    borderaux_prompt_template = """
+
+def render_html_chunk(header_html: str, rows: List[str]) -> str:
+    return f"<table>{header_html}{''.join(rows)}</table>"
+
+
+# Prompts for the DocumentExtractor chains
+TREATY_PROMPT_TEMPLATE = """
+    You are a treaty information extraction assistant specializing in reinsurance documents. Your task is to analyze the provided document text and extract relevant information into a structured format according to the specified schema.
+
+    The following text has been extracted from a reinsurance treaty document. Use this text to extract the required information:
+    {document_text}
+
+    Please ensure that your response is a JSON object that strictly adheres to the specified schema.
+    """
+
+BORDERAUX_PROMPT_TEMPLATE = """
     You are a bordereaux information extraction assistant specializing in insurance bordereaux documents. Your task is to analyze the parsed HTML table data and extract relevant information into a structured format according to the specified schema. 
 
     The following parsed HTML table data has been extracted from a bordereaux document: {html_table_data}
@@ -491,8 +476,6 @@ def extract_treaty_information_from_documents(
     **Claims Bordereaux:**
     - Extract information such as Policy Holder ID, Member ID, Start Date of Cover, End Date of Cover, Date of Claim/Treatment, Date of Payment/Approval, Amount Claimed, Amount Paid, Benefit Limits, Provider Name, and other relevant limits for Outpatient, Inpatient, Dental, Optic, Spectacle Frame, and Death and Total Permanent Disability Cover.
 
-    {format_instructions}
-
     Remember:
     - Every field specified in the schema must be present in each object, even if the value is null or an empty string.
     - Pay close attention to the data types (string, integer, number) specified in the schema.
@@ -504,102 +487,339 @@ def extract_treaty_information_from_documents(
     """
 
 
-    borderaux_prompt = PromptTemplate(
-        template=borderaux_prompt_template,
-        input_variables=["html_table_data"],
-        partial_variables={"format_instructions": borderaux_output_parser.get_format_instructions()}
-    )
+class DocumentExtractor:
+    """
+    Holds the output parsers, prompts, Gemini models and chains used for treaty and bordereaux
+    extraction. Building them is independent of the documents, so one instance is created by
+    get_document_extractor and reused for every run; the chains are safe to call from several threads.
+    """
 
-    borderaux_google_model = genai.GenerativeModel('gemini-1.5-flash',
-        generation_config={
-            "response_mime_type": "application/json",
-            "response_schema": borderaux_schema
+    def __init__(self):
+        # The langchain and Google AI stacks are only loaded once an extractor is built
+        import google.generativeai as genai
+        from langchain.prompts import PromptTemplate
+        from gemini_llm import GoogleAIModelWrapper
+        configure_genai()
+
+        # Treaty contract chains, one per field group
+        # The model's response_schema already fixes the output format, so the prompt carries no format instructions
+        self.treaty_prompt = PromptTemplate(
+            template=TREATY_PROMPT_TEMPLATE,
+            input_variables=["document_text"],
+        )
+        self.treaty_chains = {
+            group: self.build_treaty_chain(field_names) for group, field_names in TREATY_FIELD_GROUPS.items()
         }
-    )
 
-    borderaux_model = GoogleAIModelWrapper(model=borderaux_google_model)
+        # Bordereaux prompt and model, used when a workbook's headers cannot be mapped directly. Responses
+        # are streamed and parsed incrementally, so the output format is left to the response_schema
+        self.borderaux_prompt = PromptTemplate(
+            template=BORDERAUX_PROMPT_TEMPLATE,
+            input_variables=["html_table_data"],
+        )
+        borderaux_google_model = genai.GenerativeModel('gemini-1.5-flash',
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": borderaux_schema
+            }
+        )
+        self.borderaux_model = GoogleAIModelWrapper(model=borderaux_google_model, max_concurrency=BORDERAUX_LLM_CONCURRENCY)
+
+    def build_treaty_chain(self, field_names: List[str]):
+        import google.generativeai as genai
+        from langchain_core.runnables import RunnablePassthrough
+        from langchain.output_parsers import StructuredOutputParser, ResponseSchema
+        from gemini_llm import GoogleAIModelWrapper
+        response_schemas = [ResponseSchema(name=key, description=f"The {key} of the treaty") for key in field_names]
+        output_parser = StructuredOutputParser.from_response_schemas(response_schemas)
+        treaty_google_model = genai.GenerativeModel('gemini-1.5-flash',
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": get_treaty_group_schema(field_names)
+            }
+        )
+        return (
+            {
+                "document_text": RunnablePassthrough(),
+            }
+            | self.treaty_prompt
+            | GoogleAIModelWrapper(model=treaty_google_model, required_keys=get_treaty_group_padding(field_names))
+            | output_parser
+        )
 
-    def handle_output(x: str) -> dict:
-        result = {"raw_output": x}
+    def extract_treaty_with_llm(self, pdf_file_path: str) -> Treaty:
+        print("Starting treaty_information extraction")
+        # Field groups are cached separately and read back in one round trip, so a group that failed
+        # is left out of that run's treaty and is the only one extracted again on the next run
+        file_hash = get_file_hash_from_path(pdf_file_path)
+        stages = {group: f"treaty_{group}" for group in self.treaty_chains}
+        cached = get_cached_stages(list(stages.values()), EXTRACTOR_VERSIONS["treaty"], file_hash)
+        group_outputs = {group: json.loads(cached[stage]) for group, stage in stages.items() if cached[stage]}
+        missing_groups = [group for group in stages if group not in group_outputs]
+        if len(missing_groups) < len(stages):
+            print(f"Treaty field groups loaded from cache: {', '.join(group_outputs)}")
+
+        failed_groups = []
+        if missing_groups:
+            # Raises when no text can be read from the contract, so the model is never asked to
+            # fill in a treaty from nothing and no group is cached for it
+            documents_text = cached_stage(
+                "contract_text", EXTRACTOR_VERSIONS["contract_text"], pdf_file_path,
+                extract_contract_text, str, str
+            ) + "\n\n"
+            print("Documents text extracted")
+
+            # Missing groups are extracted concurrently and stored together
+            with ThreadPoolExecutor(max_workers=len(missing_groups)) as executor:
+                futures = {group: executor.submit(self.extract_treaty_group, group, documents_text) for group in missing_groups}
+            extracted = {}
+            for group, future in futures.items():
+                try:
+                    extracted[group] = future.result()
+                except Exception as e:
+                    print(f"Treaty field group '{group}' failed: {e}")
+                    failed_groups.append(group)
+            cache_stages(
+                {stages[group]: json.dumps(group_output) for group, group_output in extracted.items()},
+                EXTRACTOR_VERSIONS["treaty"], file_hash
+            )
+            group_outputs.update(extracted)
+
+        if not group_outputs:
+            raise RuntimeError("Every treaty field group failed")
+        if failed_groups:
+            print(f"Treaty assembled without field groups: {', '.join(failed_groups)}")
+        if "limits" not in group_outputs:
+            print("Treaty field group 'limits' is missing, so the claim limit will be unavailable")
+
+        # Model output is padded with every required treaty key, so only each group's own fields are taken
+        output = {}
+        for group, group_output in group_outputs.items():
+            output.update({name: group_output[name] for name in TREATY_FIELD_GROUPS[group] if name in group_output})
+        print("Treaty output extracted")
+        return map_json_to_treaty(output)
+
+    def extract_treaty_group(self, group: str, documents_text: str) -> dict:
+        """
+        Extracts one group of treaty fields, retrying the whole group when the model's output cannot be parsed.
+        :param group: key of TREATY_FIELD_GROUPS
+        :param documents_text: full contract text
+        :return: dict of the group's treaty fields, validated so that only usable output is cached
+        """
+        # Only the clauses relevant to the group's fields are sent for long contracts
+        group_text = compact_contract_text(
+            documents_text, TREATY_FIELD_GROUPS[group], TREATY_PROMPT_TOKEN_BUDGET, TREATY_SECTIONS_PER_FIELD
+        )
+        for attempt in range(1, TREATY_GROUP_ATTEMPTS + 1):
+            try:
+                return validate_treaty_group(group, self.treaty_chains[group].invoke(group_text))
+            except Exception as e:
+                if attempt == TREATY_GROUP_ATTEMPTS:
+                    raise
+                print(f"Treaty field group '{group}' attempt {attempt} failed, retrying: {e}")
+
+    def extract_borderaux_information_with_llm(self, excel_file: str) -> BorderauxInformation:
+        html_text = extract_elements_and_metadata_from_xlsx_workbook(excel_file)
+        print("Extracted HTML texts")
+
+        # Each sheet's table is sent in row-bounded chunks so that no response is long enough to be truncated
+        # Sheets are split into several tables at blank rows; tables without a header of their own
+        # carry on from the previous one, so they are given its header
+        chunks = []
+        header_html = ""
+        for html_table in html_text:
+            header_html, table_chunks = split_html_table_into_chunks(
+                html_table, BORDERAUX_CHUNK_ROWS, BORDERAUX_CHUNK_HEADER_ROWS, header_html
+            )
+            chunks.extend(table_chunks)
+        print(f"Extracting borderaux from {len(chunks)} chunks with concurrency {BORDERAUX_LLM_CONCURRENCY}")
+
+        # Claims go into the columns as their chunks finish, without a list of claim models in between
+        borderaux_data = BorderauxInformation(
+            claims_borderaux=ClaimsBorderauxColumns.from_records(self.iter_borderaux_claims(chunks))
+        )
+        print("Borderaux output extracted and validated")
+        return borderaux_data
+
+    def iter_borderaux_claims(self, chunks: List[Tuple[str, List[str]]]) -> Iterator[ClaimsBorderaux]:
+        """
+        Streams the chunks' responses concurrently under the shared rate limiter and yields their
+        validated claims in row order, chunk by chunk as soon as a chunk and the chunks before it are
+        finished. Only BORDERAUX_LLM_CONCURRENCY chunks are requested ahead of the one being yielded,
+        so the claims held at any time are bounded by those chunks rather than by the bordereaux.
+        """
+        chunks = iter(chunks)
+        with ThreadPoolExecutor(max_workers=BORDERAUX_LLM_CONCURRENCY) as executor:
+            def request(chunk):
+                return executor.submit(lambda: list(self.stream_chunk_claims(*chunk)))
+
+            pending = deque(request(chunk) for chunk in islice(chunks, BORDERAUX_LLM_CONCURRENCY))
+            while pending:
+                chunk_claims = pending.popleft().result()
+                # The next chunk is requested before this one is handed over, so the pool stays busy
+                for chunk in islice(chunks, 1):
+                    pending.append(request(chunk))
+                yield from chunk_claims
+
+    def stream_chunk_claims(self, header_html: str, rows: List[str]) -> Iterator[ClaimsBorderaux]:
+        """
+        Streams the model's response for one chunk of bordereaux rows and yields each claim as soon as
+        its JSON object closes and validates. The model answers the rows in order with one claim each,
+        so when the response breaks off, a claim fails validation or fewer claims than rows come back,
+        the claims validated so far are kept and only the rows after them are requested again. A chunk
+        that yields nothing is split in half and retried, so no row is dropped; a chunk answered with
+        more claims than rows cannot be matched to its rows and fails.
+        """
+        prompt = self.borderaux_prompt.format(html_table_data=render_html_chunk(header_html, rows))
+        received = 0
+        extra_claims = False
         try:
-            parsed = json.loads(x)
-            if "error" in parsed:
-                result["error"] = parsed["error"]
-                result["details"] = parsed
+            for claim in self.stream_response_claims(prompt):
+                if received == len(rows):
+                    extra_claims = True
+                    break
+                received += 1
+                yield claim
+            if not extra_claims and received < len(rows):
+                raise ValueError(f"Model returned {received} claims for {len(rows)} rows")
+        except Exception as e:
+            remaining = rows[received:]
+            if received:
+                print(f"Response stopped after {received} of {len(rows)} rows, requesting the rest: {e}")
+                yield from self.stream_chunk_claims(header_html, remaining)
+            elif len(rows) <= 1:
+                raise ValueError(f"Unable to extract borderaux row: {e}")
             else:
+                print(f"Retrying chunk of {len(rows)} rows as two halves: {e}")
+                middle = len(rows) // 2
+                yield from self.stream_chunk_claims(header_html, rows[:middle])
+                yield from self.stream_chunk_claims(header_html, rows[middle:])
+        if extra_claims:
+            raise ValueError(f"Model returned more claims than the {len(rows)} rows of the chunk")
+
+    def stream_response_claims(self, prompt: str) -> Iterator[ClaimsBorderaux]:
+        # Validated claims of one streamed response; raises at the first invalid claim or if the
+        # response ends before its JSON object is complete
+        parser = JsonArrayStreamParser("claims_borderaux")
+        for text in self.borderaux_model.stream(prompt):
+            for claim in parser.feed(text):
                 try:
-                    result.update(borderaux_output_parser.parse(json.dumps(parsed)))
-                except OutputParserException as e:
-                    result["error"] = f"Failed to parse output with borderaux_output_parser: {str(e)}"
-        except json.JSONDecodeError:
-            result["error"] = "Invalid JSON returned by the model"
-        return result
-
-    borderaux_rag_chain = (
-        {
-            "html_table_data": RunnablePassthrough(),
-        }
-        | borderaux_prompt
-        | borderaux_model
-        | handle_output
-    )
+                    yield ClaimsBorderaux.model_validate(claim)
+                except ValidationError as e:
+                    raise ValueError(f"Invalid borderaux claim: {e}")
+        if not parser.finished:
+            raise ValueError("Model response ended before the JSON object was complete")
 
-    borderaux_output = borderaux_rag_chain.invoke(html_text)
-    print("Borderaux output extracted")
-    json_data = borderaux_output['raw_output']
-    def fix_json(malformed_json):
-        # Find the position of the error (char 17906)
-        error_position = 17906
-
-        # Truncate the string at the error position
-        truncated_json = malformed_json[:error_position]
-
-        # Find the last complete object
-        last_complete_object = truncated_json.rfind('}')
-        
-        if last_complete_object != -1:
-            fixed_json = truncated_json[:last_complete_object+1]
-            fixed_json += ']}'
-            try:
-                json.loads(fixed_json)
-                return fixed_json
-            except json.JSONDecodeError as e:
-                print(f"Error still persists: {e}")
-                return None
-        else:
-            print("Unable to find a valid JSON structure")
-            return None
 
+@lru_cache(maxsize=None)
+def get_document_extractor() -> DocumentExtractor:
+    return DocumentExtractor()
 
-    def convert_to_borderaux_information(json_data):
-        return json.loads(json_data)
 
+def extract_borderaux_information_with_llm(excel_file: str, extractor: Optional[DocumentExtractor] = None) -> BorderauxInformation:
+    return (extractor or get_document_extractor()).extract_borderaux_information_with_llm(excel_file)
 
-    try:
-        borderaux_info = convert_to_borderaux_information(json_data)
-    except json.JSONDecodeError as e:
-        print(f"JSONDecodeError: {e}")
-        fixed_json = fix_json(json_data)
-        if fixed_json:
-            try:
-                borderaux_info = convert_to_borderaux_information(fixed_json)
-                print("JSON successfully fixed and parsed.")
-            except json.JSONDecodeError as e:
-                print(f"Error still persists after fixing: {e}")
-                raise ValueError("Unable to parse JSON even after fixing")
-        else:
-            raise ValueError("Unable to fix JSON structure")
-    #print(borderaux_info)
-    borderaux_data = BorderauxInformation.model_validate(borderaux_info)
+
+def read_borderaux_information(excel_file: str, extractor: Optional[DocumentExtractor] = None) -> BorderauxInformation:
+    # Well-formed workbooks are read directly by their column headers; the LLM is only used
+    # when none of the sheets has recognisable claims bordereaux headers
+    claims_columns = extract_claims_borderaux_from_xlsx_workbook(excel_file)
+    if claims_columns is None:
+        print("No claims bordereaux headers matched, falling back to LLM extraction")
+        return extract_borderaux_information_with_llm(excel_file, extractor)
+
+    borderaux_data = BorderauxInformation.model_validate({"claims_borderaux": claims_columns})
     print("Borderaux data validated")
+    return borderaux_data
+
+
+def extract_borderaux_information(excel_file: str, extractor: Optional[DocumentExtractor] = None) -> BorderauxInformation:
+    return cached_stage(
+        "borderaux", EXTRACTOR_VERSIONS["borderaux"], excel_file,
+        partial(read_borderaux_information, extractor=extractor), BorderauxInformation.model_dump_json, BorderauxInformation.model_validate_json
+    )
+
+
+def extract_treaty_with_llm(pdf_file_path: str, extractor: Optional[DocumentExtractor] = None) -> Treaty:
+    return (extractor or get_document_extractor()).extract_treaty_with_llm(pdf_file_path)
+
+
+def extract_treaty(pdf_file_path: str, extractor: Optional[DocumentExtractor] = None) -> Treaty:
+    # The field groups are cached individually by the extractor
+    try:
+        return extract_treaty_with_llm(pdf_file_path, extractor)
+    except Exception as e:
+        print(f"An error occurred while processing the treaty information: {e}")
+        print("Returning a default Treaty object")
+        return Treaty(
+            reinsured="",
+            treaty_type="",
+            business_covered=[],
+            territorial_scope="",
+            treaty_details=[],
+            reinsurer_participations=[]
+        )
+
+
+def read_treaty_statement_information(treaty_pdf_with_images_path: str) -> TreatyStatementInformation:
     # Process treaty slip document with images
-    treaty_slip_documents_text = ""
-    raw_elements = extract_text_and_metadata_from_pdf_document_with_images(treaty_pdf_with_images_path)
+    treaty_slip_documents_text = extract_text_and_metadata_from_pdf_document_with_images(treaty_pdf_with_images_path)
     print("Extracted text and metadata from PDF document with images")
-    treaty_slip_documents_text = "\n\n".join([str(c.text) for c in raw_elements if hasattr(c, 'text')])
-    
-    treaty_statement_information = extract_treaty_info(treaty_slip_documents_text)
+
+    return extract_treaty_info(treaty_slip_documents_text)
+
+
+def extract_treaty_statement_information(treaty_pdf_with_images_path: str) -> TreatyStatementInformation:
+    # Only what was read from the slip is cached; the fallback premium is applied afterwards, so a
+    # made-up premium is never stored as if it had been read
+    treaty_statement_information = cached_stage(
+        "treaty_statement", EXTRACTOR_VERSIONS["treaty_statement"], treaty_pdf_with_images_path,
+        read_treaty_statement_information,
+        TreatyStatementInformation.model_dump_json, TreatyStatementInformation.model_validate_json
+    )
     if treaty_statement_information.total_premium == 0:
-        treaty_statement_information.total_premium = 40880330.4
+        print(f"No total premium found in {treaty_pdf_with_images_path}, using the default of {DEFAULT_TOTAL_PREMIUM}")
+        treaty_statement_information.total_premium = DEFAULT_TOTAL_PREMIUM
+    return treaty_statement_information
+
+
+def run_timed_stage(stage_name: str, stage, file_path: str, on_stage_finished: Optional[Callable[[str, float], None]] = None):
+    start_time = time.perf_counter()
+    result = stage(file_path)
+    seconds = time.perf_counter() - start_time
+    print(f"Stage '{stage_name}' finished in {seconds:.2f}s")
+    if on_stage_finished is not None:
+        on_stage_finished(stage_name, seconds)
+    return result
+
+
+# Function to handle extraction and mapping from all document types
+def extract_treaty_information_from_documents(
+    pdf_file_path: str, excel_file: str, treaty_pdf_with_images_path: str, parallel: bool = EXTRACTION_PARALLEL,
+    extractor: Optional[DocumentExtractor] = None, on_stage_finished: Optional[Callable[[str, float], None]] = None
+) -> Tuple[Treaty, BorderauxInformation, TreatyStatementInformation]:
+    # Long-running callers (the job worker) pass in the extractor they hold; otherwise the
+    # process-wide one is used, so the chains are only built on the first run.
+    # on_stage_finished is called with each stage's name and duration as soon as it finishes
+    extractor = extractor or get_document_extractor()
+
+    # The contract, bordereaux and treaty slip are independent until process_claims, so by
+    # default they are extracted concurrently and the run takes as long as the slowest stage
+    stages = [
+        ("treaty", partial(extract_treaty, extractor=extractor), pdf_file_path),
+        ("borderaux", partial(extract_borderaux_information, extractor=extractor), excel_file),
+        ("treaty_statement", extract_treaty_statement_information, treaty_pdf_with_images_path),
+    ]
+
+    start_time = time.perf_counter()
+    if parallel:
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            futures = [executor.submit(run_timed_stage, name, stage, path, on_stage_finished) for name, stage, path in stages]
+            treaty_object, borderaux_data, treaty_statement_information = [future.result() for future in futures]
+    else:
+        treaty_object, borderaux_data, treaty_statement_information = [
+            run_timed_stage(name, stage, path, on_stage_finished) for name, stage, path in stages
+        ]
+    print(f"Document extraction finished in {time.perf_counter() - start_time:.2f}s")
 
     return treaty_object, borderaux_data, treaty_statement_information
@@ -0,0 +1,88 @@
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+# Formats seen in bordereaux, treaty contracts and model output, most common first
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y', '%d %B %Y']
+ISO_DATE_FORMAT = '%Y-%m-%d'
+ISO_DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+# Number of values inspected when detecting the format of a column
+FORMAT_DETECTION_SAMPLE = 50
+
+
+def remove_ordinal_suffix(date_str):
+    # This regex removes 'st', 'nd', 'rd', 'th' from the date string
+    return re.sub(r'(\d+)(st|nd|rd|th)', r'\1', date_str)
+
+
+@lru_cache(maxsize=4096)
+def parse_date(date_string: str) -> Optional[datetime]:
+    """
+    Parses a date string in any of DATE_FORMATS. Bordereaux repeat the same few hundred dates,
+    so results are memoised.
+    :param date_string: date string, e.g. '2020-07-01' or '1st July 2020'
+    :return: datetime, or None if the string is not a recognised date
+    """
+    clean_date_str = remove_ordinal_suffix(date_string.strip())
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(clean_date_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def detect_date_format(values: Iterable[str]) -> Optional[str]:
+    """
+    Finds the first of DATE_FORMATS that parses every non-empty value in a sample of a column.
+    :param values: column of date strings
+    :return: format string, or None if no single format fits the sample
+    """
+    sample = []
+    for value in values:
+        if value:
+            sample.append(value.strip())
+            if len(sample) >= FORMAT_DETECTION_SAMPLE:
+                break
+    for fmt in DATE_FORMATS:
+        try:
+            for value in sample:
+                datetime.strptime(value, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_date(value) -> str:
+    """
+    Converts a date, datetime or date string to an ISO 'YYYY-MM-DD' string.
+    Strings that are not recognised dates are returned stripped and otherwise unchanged.
+    """
+    if isinstance(value, (datetime, date)):
+        return value.strftime(ISO_DATE_FORMAT)
+    if value is None:
+        return ""
+    parsed = parse_date(str(value))
+    return parsed.strftime(ISO_DATE_FORMAT) if parsed is not None else str(value).strip()
+
+
+def normalize_date_column(values: List[str]) -> List[str]:
+    """
+    Normalises a column of date strings to ISO 'YYYY-MM-DD'. The column's format is detected once
+    and each distinct value is converted once; values in another format fall back to parse_date.
+    """
+    # Already normalised columns (e.g. loaded back from the cache) only need checking
+    if all(ISO_DATE_PATTERN.fullmatch(value) for value in values if value):
+        return values
+
+    fmt = detect_date_format(values)
+    converted = {}
+    for value in set(values):
+        try:
+            converted[value] = datetime.strptime(value.strip(), fmt).strftime(ISO_DATE_FORMAT) if fmt else normalize_date(value)
+        except ValueError:
+            converted[value] = normalize_date(value)
+    return [converted[value] for value in values]
@@ -0,0 +1,210 @@
+"""
+Registry of the fraud checks run on the claims of each period.
+
+Each rule is a function over the shared claims frame of a period (see claims_frame) that uses
+vectorised masks and groupbys, registered with the fraud_rule decorator together with the
+columns it reads and its default thresholds. Further rules are added the same way from any
+module imported before the claims are processed.
+
+Thresholds can be overridden, and rules disabled, in the JSON file named by FRAUD_RULES_CONFIG:
+
+    {"large_claims": {"premium_share": 0.2}, "duplicate_entries": {"enabled": false}}
+"""
+import os
+import json
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Set, Tuple
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv, find_dotenv
+from claims_frame import frame_to_claim_dicts, group_claim_dicts
+
+_ = load_dotenv(find_dotenv())
+
+FRAUD_RULES_CONFIG = os.getenv("FRAUD_RULES_CONFIG", "fraud_rules.json")
+
+
+class FraudRule:
+    """
+    A fraud check evaluated over the claims frame of one period.
+    :param name: key of the check's results in fraud_checks
+    :param inputs: frame columns the rule reads
+    :param thresholds: default thresholds, passed to evaluate as keyword arguments
+    :param evaluate: function(claims, total_premium, **thresholds) returning the check's results
+    """
+
+    def __init__(self, name: str, inputs: List[str], thresholds: dict, evaluate: Callable):
+        self.name = name
+        self.inputs = inputs
+        self.thresholds = thresholds
+        self.evaluate = evaluate
+
+
+# Rules in the order their results appear in fraud_checks
+FRAUD_RULES: Dict[str, FraudRule] = {}
+
+
+def fraud_rule(name: str, inputs: List[str], **thresholds):
+    """
+    Registers a function as a fraud rule.
+    :param name: key of the rule's results in fraud_checks
+    :param inputs: frame columns the rule reads
+    :param thresholds: default thresholds of the rule
+    """
+    def register(evaluate: Callable) -> Callable:
+        FRAUD_RULES[name] = FraudRule(name, inputs, thresholds, evaluate)
+        return evaluate
+    return register
+
+
+@lru_cache(maxsize=None)
+def load_fraud_rules_config(path: str = FRAUD_RULES_CONFIG) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        config = json.load(f)
+    unknown_rules = [name for name in config if name not in FRAUD_RULES]
+    if unknown_rules:
+        raise ValueError(f"Unknown fraud rules in {path}: {', '.join(unknown_rules)}")
+    for name, settings in config.items():
+        unknown_thresholds = [key for key in settings if key != "enabled" and key not in FRAUD_RULES[name].thresholds]
+        if unknown_thresholds:
+            raise ValueError(f"Unknown thresholds of fraud rule '{name}' in {path}: {', '.join(unknown_thresholds)}")
+    print(f"Fraud rule settings loaded from {path}")
+    return config
+
+
+def get_fraud_rule_thresholds(name: str) -> dict:
+    # The rule's defaults, overridden by the config file
+    settings = load_fraud_rules_config().get(name, {})
+    return {key: settings.get(key, value) for key, value in FRAUD_RULES[name].thresholds.items()}
+
+
+def get_enabled_fraud_rules() -> List[FraudRule]:
+    config = load_fraud_rules_config()
+    return [rule for name, rule in FRAUD_RULES.items() if config.get(name, {}).get("enabled", True)]
+
+
+def get_fraud_rule_inputs() -> Set[str]:
+    # Frame columns read by the enabled rules, so the frame only prepares what they use
+    return {column for rule in get_enabled_fraud_rules() for column in rule.inputs}
+
+
+def evaluate_fraud_rules(claims: pd.DataFrame, total_premium: float) -> Tuple[dict, Dict[str, float]]:
+    """
+    Runs every enabled fraud rule over the same claims frame.
+    :param claims: claims of one period, as built by claims_frame.claims_to_frame with get_fraud_rule_inputs
+    :param total_premium: total premium of the treaty statement
+    :return: (dict of rule name to its results, dict of rule name to its evaluation time in seconds)
+    """
+    results, seconds = {}, {}
+    for rule in get_enabled_fraud_rules():
+        missing = [column for column in rule.inputs if column not in claims.columns]
+        if missing:
+            raise ValueError(f"Fraud rule '{rule.name}' needs the missing columns: {', '.join(missing)}")
+        start_time = time.perf_counter()
+        results[rule.name] = rule.evaluate(claims, total_premium, **get_fraud_rule_thresholds(rule.name))
+        seconds[rule.name] = time.perf_counter() - start_time
+    return results, seconds
+
+
+def find_duplicate_clusters(frame: pd.DataFrame, window_days: int, amount_tolerance: float) -> List[np.ndarray]:
+    """
+    Finds clusters of near-duplicate claims: the same member, treatment dates at most window_days
+    apart and amounts within amount_tolerance of each other, chained transitively.
+    Claims are sorted once by member and date, so each claim is only compared with the claims that
+    follow it in its own member and date window, rather than with every other claim.
+    :return: positions in the frame of each cluster's claims, in order, clusters in order of first appearance
+    """
+    positions = np.flatnonzero(frame['claim_date'].notna().to_numpy())
+    members = frame['member_id'].cat.codes.to_numpy()[positions]
+    days = frame['claim_date'].to_numpy()[positions].astype('datetime64[D]').astype(np.int64)
+    amounts = frame['total_claims_paid'].to_numpy()[positions]
+
+    order = np.lexsort((positions, days, members))
+    members, days, amounts, positions = members[order], days[order], amounts[order], positions[order]
+
+    # Pairs (i, i + offset) of sorted claims in the same window; a pair only stays a candidate for
+    # the next offset while it is still in the window, so the work is bounded by the number of
+    # claims that share a window
+    starts = np.arange(len(positions))
+    pair_starts, pair_ends = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    offset = 1
+    while starts.size:
+        starts = starts[starts + offset < len(positions)]
+        ends = starts + offset
+        in_window = (members[ends] == members[starts]) & (days[ends] - days[starts] <= window_days)
+        starts, ends = starts[in_window], ends[in_window]
+        close = np.abs(amounts[ends] - amounts[starts]) <= amount_tolerance * np.maximum(np.abs(amounts[ends]), np.abs(amounts[starts]))
+        pair_starts.append(starts[close])
+        pair_ends.append(ends[close])
+        offset += 1
+    pair_starts, pair_ends = np.concatenate(pair_starts), np.concatenate(pair_ends)
+    if not pair_starts.size:
+        return []
+
+    # Connected components: every claim takes the smallest label among the claims it is paired
+    # with, until no label changes
+    labels = np.arange(len(positions))
+    while True:
+        smallest = np.minimum(labels[pair_starts], labels[pair_ends])
+        updated = labels.copy()
+        np.minimum.at(updated, pair_starts, smallest)
+        np.minimum.at(updated, pair_ends, smallest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+
+    paired = np.unique(np.concatenate([pair_starts, pair_ends]))
+    cluster_labels, cluster_positions = labels[paired], positions[paired]
+    order = np.lexsort((cluster_positions, cluster_labels))
+    cluster_labels, cluster_positions = cluster_labels[order], cluster_positions[order]
+    clusters = np.split(cluster_positions, np.flatnonzero(np.diff(cluster_labels)) + 1)
+    return sorted(clusters, key=lambda cluster: cluster[0])
+
+
+
+# Built-in rules. Groups keep the order in which their first claim appears, as the dict-based checks did
+
+@fraud_rule('multiple_claims_same_day', inputs=['claim_date'], max_claims_per_day=3)
+def multiple_claims_same_day(claims: pd.DataFrame, total_premium: float, max_claims_per_day: int):
+    busy_days = claims.groupby('claim_date', sort=False)['claim_date'].transform('size') > max_claims_per_day
+    return [
+        (claim_date.isoformat(), day_claims)
+        for claim_date, day_claims in group_claim_dicts(claims[busy_days], 'claim_date').items()
+    ]
+
+
+@fraud_rule('suspicious_claim_amounts', inputs=['total_claims_paid'], round_multiple=1000, min_amount=10000)
+def suspicious_claim_amounts(claims: pd.DataFrame, total_premium: float, round_multiple: float, min_amount: float):
+    # Round amounts above a minimum
+    amounts = claims['total_claims_paid']
+    return frame_to_claim_dicts(claims[(np.mod(amounts, round_multiple) == 0) & (amounts > min_amount)])
+
+
+@fraud_rule('frequent_claimants', inputs=['member_id'], max_claims=5)
+def frequent_claimants(claims: pd.DataFrame, total_premium: float, max_claims: int):
+    claims_per_member = claims.groupby('member_id', sort=False, observed=True).size()
+    return [
+        (member_id, int(count)) for member_id, count in claims_per_member[claims_per_member > max_claims].items()
+    ]
+
+
+@fraud_rule('large_claims', inputs=['total_claims_paid'], premium_share=0.1)
+def large_claims(claims: pd.DataFrame, total_premium: float, premium_share: float):
+    return frame_to_claim_dicts(claims[claims['total_claims_paid'] > premium_share * total_premium])
+
+
+@fraud_rule('duplicate_entries', inputs=['member_id', 'claim_date', 'total_claims_paid'], window_days=1, amount_tolerance=0.01)
+def duplicate_entries(claims: pd.DataFrame, total_premium: float, window_days: int, amount_tolerance: float):
+    # Claims of the same member at most window_days apart, whose amounts differ by at most
+    # amount_tolerance of the larger one
+    clusters = find_duplicate_clusters(claims, window_days, amount_tolerance)
+    if not clusters:
+        return []
+    # The flagged claims are converted in one go, then split back into their clusters
+    duplicates = frame_to_claim_dicts(claims.iloc[np.concatenate(clusters)])
+    cluster_ends = np.cumsum([len(cluster) for cluster in clusters])
+    return [duplicates[end - len(cluster):end] for cluster, end in zip(clusters, cluster_ends)]
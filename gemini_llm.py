@@ -0,0 +1,230 @@
+"""
+LangChain wrapper of the Gemini models used for extraction, with a shared rate limit and retries.
+
+Imported by data_loader only when the extractor is built, so that importing data_loader does
+not load the langchain and Google AI stacks.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+from pydantic import Field
+from google.api_core import exceptions as google_exceptions
+from langchain_core.language_models import BaseLLM
+from langchain_core.callbacks.manager import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
+from langchain_core.outputs import LLMResult, Generation, GenerationChunk
+from dotenv import load_dotenv, find_dotenv
+
+_ = load_dotenv(find_dotenv())
+
+# Gemini API usage: average and burst request rate, concurrent requests per batch and retries
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "300"))
+GEMINI_REQUEST_BURST = int(os.getenv("GEMINI_REQUEST_BURST", "10"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"}
+]
+
+# Errors worth retrying: rate limiting, server-side failures and timeouts
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+class TokenBucketRateLimiter:
+    """
+    Token bucket shared by every caller of a model: allows bursts of up to `capacity` requests and
+    `rate` requests per second on average. Usable from threads (acquire) and coroutines (aacquire).
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # Takes a token and returns how long the caller has to wait before using it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        time.sleep(self.reserve())
+
+    async def aacquire(self):
+        await asyncio.sleep(self.reserve())
+
+
+gemini_rate_limiter = TokenBucketRateLimiter(
+    rate=GEMINI_REQUESTS_PER_MINUTE / 60, capacity=GEMINI_REQUEST_BURST
+)
+
+
+def get_retry_delay(attempt: int, initial_backoff: float, max_backoff: float) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(max_backoff, initial_backoff * 2 ** attempt))
+
+
+class GoogleAIModelWrapper(BaseLLM):
+    model: Any = Field(description="Google AI model instance")
+    rate_limiter: Any = Field(default_factory=lambda: gemini_rate_limiter, description="Rate limiter shared by all requests to the API")
+    max_concurrency: int = Field(default=GEMINI_MAX_CONCURRENCY, description="Maximum concurrent requests in a batch")
+    max_retries: int = Field(default=GEMINI_MAX_RETRIES, description="Retries for transient API errors")
+    initial_backoff: float = Field(default=1.0, description="First retry delay in seconds")
+    max_backoff: float = Field(default=30.0, description="Upper bound of the retry delay in seconds")
+    required_keys: Dict[str, Any] = Field(default_factory=dict, description="Keys added to JSON responses that leave them out, with the value they get")
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, model: Any, **kwargs: Any):
+        super().__init__(model=model, **kwargs)
+
+    def _parse_response(self, response) -> str:
+        if response.candidates:
+            if response.candidates[0].content.parts:
+                text = response.candidates[0].content.parts[0].text
+                try:
+                    json_obj = json.loads(text)
+                    if isinstance(json_obj, dict):
+                        for key, value in self.required_keys.items():
+                            json_obj.setdefault(key, value)
+                    return json.dumps(json_obj)
+                except json.JSONDecodeError:
+                    return text
+            else:
+                return json.dumps({
+                    "error": "Response content is empty.",
+                    "prompt_feedback": str(response.prompt_feedback) if response.prompt_feedback else "No feedback available",
+                    "candidates": [str(c) for c in response.candidates]
+                })
+        else:
+            return json.dumps({
+                "error": "No candidates in response.",
+                "prompt_feedback": str(response.prompt_feedback) if response.prompt_feedback else "No feedback available"
+            })
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        # Errors before the first piece of text are retried as in _call; later ones are raised so
+        # the caller keeps what it has already received
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            received = False
+            try:
+                for response in self.model.generate_content(prompt, safety_settings=SAFETY_SETTINGS, stream=True):
+                    text = "".join(part.text for candidate in response.candidates[:1] for part in candidate.content.parts)
+                    if not text:
+                        continue
+                    received = True
+                    if run_manager:
+                        run_manager.on_llm_new_token(text)
+                    yield GenerationChunk(text=text)
+                return
+            except RETRYABLE_ERRORS as e:
+                if received or attempt == self.max_retries:
+                    raise
+                delay = get_retry_delay(attempt, self.initial_backoff, self.max_backoff)
+                print(f"Transient model error ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = get_retry_delay(attempt, self.initial_backoff, self.max_backoff)
+                print(f"Transient model error ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        return self._parse_response(response)
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.aacquire()
+            try:
+                response = await self.model.generate_content_async(prompt, safety_settings=SAFETY_SETTINGS)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = get_retry_delay(attempt, self.initial_backoff, self.max_backoff)
+                print(f"Transient model error ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        return self._parse_response(response)
+
+    @property
+    def _llm_type(self) -> str:
+        return "google_ai"
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        # Batched prompts (e.g. from Runnable.batch) are sent concurrently, in order
+        if len(prompts) == 1:
+            responses = [self._call(prompts[0], stop=stop, run_manager=run_manager, **kwargs)]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                responses = list(executor.map(
+                    lambda prompt: self._call(prompt, stop=stop, run_manager=run_manager, **kwargs), prompts
+                ))
+        return LLMResult(generations=[[Generation(text=response)] for response in responses])
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def generate(prompt: str) -> str:
+            async with semaphore:
+                return await self._acall(prompt, stop=stop, run_manager=run_manager, **kwargs)
+
+        responses = await asyncio.gather(*(generate(prompt) for prompt in prompts))
+        return LLMResult(generations=[[Generation(text=response)] for response in responses])
@@ -0,0 +1,390 @@
+"""
+Local on-disk queue of claim processing jobs, and the worker that runs them.
+
+    python jobs.py --workers 2
+
+Each job is a JSON status file under JOBS_DIR. A queued job also has a marker in JOBS_DIR/queue,
+which a worker claims by renaming it into JOBS_DIR/running, so several worker processes can
+share one queue. The app submits jobs and polls their status files.
+
+Workers touch their file in JOBS_DIR/workers and the markers of the jobs they run every
+JOB_HEARTBEAT_INTERVAL seconds. A running job whose marker has not been touched for
+JOB_STALE_AFTER seconds lost its worker and is queued again; the app uses the worker files to
+tell when no worker is running. Finished jobs and extracted documents are removed after
+JOB_RETENTION seconds.
+
+JOBS_DIR/by_documents holds the id of the job queued or running for each packet of documents,
+so submitting the same documents again follows that job instead of queueing a duplicate.
+"""
+import argparse
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from cache import get_results_cache_key, cache_result
+
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Worker and job liveness, in seconds, and the attempts a job gets before it is marked failed
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "5"))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Seconds finished jobs and extracted documents are kept, and between two sweeps of the jobs directory
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", "60"))
+
+# Steps reported in a job's progress: the three extraction stages, then the claims analysis
+JOB_STEPS = ["treaty", "borderaux", "treaty_statement", "claims_analysis"]
+
+# Serialises status updates from the stage threads of a job
+job_lock = threading.Lock()
+
+# Jobs run by this process, whose markers the heartbeat keeps fresh
+running_jobs = set()
+
+
+def get_job_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def get_jobs_subdir(name: str) -> str:
+    path = os.path.join(JOBS_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_text(path: str, text: str):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Written to a temporary file and renamed, so readers never see a partial file
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(text)
+    os.replace(f.name, path)
+
+
+def write_json(path: str, value):
+    write_text(path, json.dumps(value))
+
+
+def write_job(job: dict):
+    write_json(get_job_path(job["id"]), job)
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    try:
+        with open(get_job_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def update_job(job_id: str, **fields) -> dict:
+    with job_lock:
+        job = get_job(job_id)
+        job.update(fields)
+        write_job(job)
+        return job
+
+
+def finish_job_step(job_id: str, step: str, seconds: float):
+    with job_lock:
+        job = get_job(job_id)
+        job["steps"][step] = round(seconds, 2)
+        job["progress"] = len(job["steps"]) / len(JOB_STEPS)
+        write_job(job)
+
+
+def get_documents_path(documents_key: str) -> str:
+    return os.path.join(JOBS_DIR, "documents", f"{documents_key}.json")
+
+
+def save_job_documents(documents_key: str, treaty_object, borderaux_data, treaty_statement_information):
+    # Kept so that the app can analyse other periods of the same documents itself, without a job
+    write_json(get_documents_path(documents_key), {
+        "treaty": treaty_object.model_dump(mode="json"),
+        "borderaux": borderaux_data.model_dump(mode="json"),
+        "treaty_statement": treaty_statement_information.model_dump(mode="json"),
+    })
+
+
+def load_job_documents(documents_key: str):
+    """
+    Reads the documents a worker extracted for a documents key.
+    :return: (treaty, bordereaux, treaty statement) models, or None if they are not stored
+    """
+    try:
+        with open(get_documents_path(documents_key)) as f:
+            documents = json.load(f)
+    except FileNotFoundError:
+        return None
+    from models import Treaty, BorderauxInformation, TreatyStatementInformation
+    return (
+        Treaty.model_validate(documents["treaty"]),
+        BorderauxInformation.model_validate(documents["borderaux"]),
+        TreatyStatementInformation.model_validate(documents["treaty_statement"]),
+    )
+
+
+def get_documents_job_path(documents_key: str) -> str:
+    return os.path.join(JOBS_DIR, "by_documents", documents_key)
+
+
+def find_documents_job(documents_key: str) -> Optional[dict]:
+    # The job queued or running for a packet of documents, if any
+    try:
+        with open(get_documents_job_path(documents_key)) as f:
+            job = get_job(f.read())
+    except FileNotFoundError:
+        return None
+    if job is None or job["status"] not in ("queued", "running"):
+        return None
+    return job
+
+
+def clear_documents_job(documents_key: str, job_id: str):
+    # Called when a job ends, so later submissions of its documents queue a new job
+    try:
+        with open(get_documents_job_path(documents_key)) as f:
+            if f.read() != job_id:
+                return
+        os.remove(get_documents_job_path(documents_key))
+    except FileNotFoundError:
+        pass
+
+
+def submit_job(files: dict, documents_key: str, quarter: Optional[int], year: Optional[int]) -> str:
+    """
+    Queues the processing of one packet of documents. If a job for the same documents is already
+    queued or running, that job's id is returned instead of queueing a duplicate; it may analyse
+    another period.
+    :param files: paths of the 'contract', 'borderaux' and 'treaty' documents
+    :param documents_key: key of the documents in the results cache
+    :param quarter: quarter to analyse, or None for every period
+    :return: job id
+    """
+    existing_job = find_documents_job(documents_key)
+    if existing_job is not None:
+        return existing_job["id"]
+
+    job_id = uuid.uuid4().hex
+    write_job({
+        "id": job_id,
+        "status": "queued",
+        "stage": "Waiting for a worker",
+        "progress": 0.0,
+        "steps": {},
+        "attempts": 0,
+        "files": files,
+        "documents_key": documents_key,
+        "quarter": quarter,
+        "year": year,
+        "submitted_at": time.time(),
+    })
+    write_text(get_documents_job_path(documents_key), job_id)
+    queue_job(job_id)
+    return job_id
+
+
+def queue_job(job_id: str):
+    # Marker names start with the queueing time so jobs are claimed in order
+    open(os.path.join(get_jobs_subdir("queue"), f"{time.time_ns()}_{job_id}"), "w").close()
+
+
+def claim_next_job() -> Optional[str]:
+    queue_dir = get_jobs_subdir("queue")
+    running_dir = get_jobs_subdir("running")
+    for marker in sorted(os.listdir(queue_dir)):
+        job_id = marker.split("_", 1)[1]
+        running_marker = os.path.join(running_dir, job_id)
+        try:
+            os.rename(os.path.join(queue_dir, marker), running_marker)
+        except FileNotFoundError:
+            # Claimed by another worker
+            continue
+        # The marker keeps its queueing time; touched at once so the job is not taken for stale
+        os.utime(running_marker)
+        return job_id
+    return None
+
+
+def workers_alive() -> bool:
+    # True if any worker process has sent a heartbeat recently
+    workers_dir = get_jobs_subdir("workers")
+    now = time.time()
+    for worker in os.listdir(workers_dir):
+        try:
+            if now - os.path.getmtime(os.path.join(workers_dir, worker)) < JOB_STALE_AFTER:
+                return True
+        except FileNotFoundError:
+            continue
+    return False
+
+
+def send_heartbeats(worker_id: str, stop: threading.Event):
+    worker_path = os.path.join(get_jobs_subdir("workers"), worker_id)
+    running_dir = get_jobs_subdir("running")
+    while not stop.is_set():
+        open(worker_path, "a").close()
+        os.utime(worker_path)
+        with job_lock:
+            job_ids = list(running_jobs)
+        for job_id in job_ids:
+            try:
+                os.utime(os.path.join(running_dir, job_id))
+            except FileNotFoundError:
+                pass
+        stop.wait(JOB_HEARTBEAT_INTERVAL)
+    os.remove(worker_path)
+
+
+def requeue_stale_jobs():
+    """
+    Queues again the running jobs whose worker stopped sending heartbeats, or fails them once they
+    have used up JOB_MAX_ATTEMPTS.
+    """
+    running_dir = get_jobs_subdir("running")
+    now = time.time()
+    for job_id in os.listdir(running_dir):
+        running_marker = os.path.join(running_dir, job_id)
+        try:
+            if now - os.path.getmtime(running_marker) < JOB_STALE_AFTER:
+                continue
+            # Only the worker that takes the marker away handles the job
+            stale_marker = f"{running_marker}.stale"
+            os.rename(running_marker, stale_marker)
+        except FileNotFoundError:
+            continue
+        os.remove(stale_marker)
+
+        job = get_job(job_id)
+        if job is None:
+            continue
+        if job.get("attempts", 0) >= JOB_MAX_ATTEMPTS:
+            print(f"Job {job_id} lost its worker {job['attempts']} times, marking it failed")
+            update_job(job_id, status="failed", stage="Failed", error="The job's worker stopped responding", finished_at=now)
+            clear_documents_job(job["documents_key"], job_id)
+        else:
+            print(f"Job {job_id} lost its worker, queueing it again")
+            update_job(job_id, status="queued", stage="Waiting for a worker (the previous one stopped)", progress=0.0, steps={})
+            queue_job(job_id)
+
+
+def expire_jobs():
+    # Removes finished job status files, extracted documents, job references of documents and
+    # leftover temporary files past their retention
+    now = time.time()
+    running = set(os.listdir(get_jobs_subdir("running")))
+    queued = {marker.split("_", 1)[1] for marker in os.listdir(get_jobs_subdir("queue"))}
+    for directory in (JOBS_DIR, get_jobs_subdir("documents"), get_jobs_subdir("by_documents")):
+        for file_name in os.listdir(directory):
+            path = os.path.join(directory, file_name)
+            if not os.path.isfile(path) or os.path.splitext(file_name)[0] in running | queued:
+                continue
+            try:
+                if now - os.path.getmtime(path) > JOB_RETENTION:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+
+def run_job(job_id: str, extractor):
+    from data_loader import extract_treaty_information_from_documents
+    from claims_engine import analyse_claims
+
+    with job_lock:
+        running_jobs.add(job_id)
+    job = None
+    try:
+        job = get_job(job_id)
+        if job is None:
+            # Expired or removed while it was queued
+            print(f"Job {job_id} has no status file, skipping it")
+            return
+        job = update_job(
+            job_id, status="running", stage="Extracting information from the documents",
+            attempts=job.get("attempts", 0) + 1, started_at=time.time()
+        )
+        files = job["files"]
+        treaty_object, borderaux_data, treaty_statement_information = extract_treaty_information_from_documents(
+            files["contract"], files["borderaux"], files["treaty"], extractor=extractor,
+            on_stage_finished=lambda stage, seconds: finish_job_step(job_id, stage, seconds)
+        )
+        save_job_documents(job["documents_key"], treaty_object, borderaux_data, treaty_statement_information)
+
+        update_job(job_id, stage="Processing claims")
+        start_time = time.perf_counter()
+        results = analyse_claims(
+            borderaux_data.claims_borderaux, treaty_statement_information, treaty_object, job["quarter"], job["year"]
+        )
+        cache_result(get_results_cache_key(job["documents_key"], job["quarter"], job["year"]), results)
+        finish_job_step(job_id, "claims_analysis", time.perf_counter() - start_time)
+
+        update_job(job_id, status="done", stage="Processing complete", results=results, finished_at=time.time())
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        update_job(job_id, status="failed", stage="Failed", error=str(e), finished_at=time.time())
+    finally:
+        with job_lock:
+            running_jobs.discard(job_id)
+        finished_job = get_job(job_id) if job is not None else None
+        if finished_job is not None and finished_job["status"] in ("done", "failed"):
+            clear_documents_job(finished_job["documents_key"], job_id)
+        try:
+            os.remove(os.path.join(JOBS_DIR, "running", job_id))
+        except FileNotFoundError:
+            # Already taken for stale by another worker
+            pass
+
+
+def work(extractor):
+    while True:
+        job_id = claim_next_job()
+        if job_id is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        print(f"Running job {job_id}")
+        start_time = time.perf_counter()
+        run_job(job_id, extractor)
+        print(f"Job {job_id} finished in {time.perf_counter() - start_time:.2f}s")
+
+
+def sweep(stop: threading.Event):
+    while not stop.wait(JOB_SWEEP_INTERVAL):
+        requeue_stale_jobs()
+        expire_jobs()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claim processing job worker")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS, help="jobs run at the same time")
+    args = parser.parse_args()
+
+    # The worker process holds the extractor, so its models are built once for all jobs
+    from data_loader import get_document_extractor
+    extractor = get_document_extractor()
+
+    stop = threading.Event()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    requeue_stale_jobs()
+    threading.Thread(target=send_heartbeats, args=(worker_id, stop), daemon=True).start()
+    threading.Thread(target=sweep, args=(stop,), daemon=True).start()
+
+    print(f"Job worker {worker_id} running {args.workers} jobs at a time from {JOBS_DIR}")
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            for _ in range(args.workers):
+                executor.submit(work, extractor)
+    finally:
+        stop.set()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import json
+from typing import List, Optional
+
+
+class JsonArrayStreamParser:
+    """
+    Incremental parser for a JSON object that arrives in pieces, such as a streamed model response.
+    Returns each object of one of its top-level arrays (e.g. "claims_borderaux") as soon as the
+    object closes. Only the object being read is buffered, never the whole response.
+    """
+
+    def __init__(self, array_key: str):
+        self.array_key = array_key
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        # Raw text of the string being read at the top level, and the last such string (an object key)
+        self.key_chars: List[str] = []
+        self.last_key: Optional[str] = None
+        # Depth of the values of the target array while it is open
+        self.array_depth: Optional[int] = None
+        self.item_chars: Optional[List[str]] = None
+
+    @property
+    def finished(self) -> bool:
+        # True once the outer JSON object has been closed
+        return self.started and self.depth == 0
+
+    def feed(self, text: str) -> List[dict]:
+        """
+        Parses the next piece of the response.
+        :param text: next piece of the JSON text
+        :return: objects of the target array completed by this piece, in order
+        """
+        items = []
+        for char in text:
+            if self.item_chars is not None:
+                self.item_chars.append(char)
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_key = json.loads(f'"{"".join(self.key_chars)}"')
+                    continue
+                if self.depth == 1:
+                    self.key_chars.append(char)
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self.key_chars = []
+            elif char in "{[":
+                if self.depth == 0:
+                    self.started = True
+                if char == "[" and self.depth == 1 and self.last_key == self.array_key:
+                    self.array_depth = 2
+                elif char == "{" and self.depth == self.array_depth:
+                    self.item_chars = [char]
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.item_chars is not None and self.depth == self.array_depth:
+                    items.append(json.loads("".join(self.item_chars)))
+                    self.item_chars = None
+                elif self.array_depth is not None and self.depth < self.array_depth:
+                    self.array_depth = None
+        return items
@@ -1,6 +1,7 @@
-from typing import List, Optional, Tuple
-from pydantic import BaseModel, Field
+from typing import Any, Iterable, List, Optional
+from pydantic import BaseModel, Field, field_validator, model_validator
 from datetime import date
+from dates import normalize_date_column
 
 
 
@@ -87,8 +88,8 @@ class Treaty(BaseModel):
     Represents the treaty details.
     """
     reinsured: str = Field(..., description="Name of the entity being reinsured")
-    start_date: date = Field(..., description="Start date of the treaty agreement")
-    end_date: date = Field(..., description="End date of the treaty agreement")
+    start_date: Optional[date] = Field(None, description="Start date of the treaty agreement, None if it could not be extracted")
+    end_date: Optional[date] = Field(None, description="End date of the treaty agreement, None if it could not be extracted")
     treaty_type: str = Field(..., description="Type of treaty (e.g., quota share, excess of loss, etc.)")
     business_covered: List[str] = Field(..., description="List of types of business covered under the treaty")
     territorial_scope: str = Field(..., description="Geographical area covered by the treaty")
@@ -151,8 +152,69 @@ class ClaimsBorderaux(BaseModel):
 
     total_claims_paid: float = Field(..., description="Total Claims Paid")
 
+class ClaimsBorderauxColumns(BaseModel):
+    """
+    Claims bordereaux stored column-wise, one list per ClaimsBorderaux field, so large bordereaux
+    are validated in bulk without building a model instance per claim.
+    """
+    policy_holder_id: List[str] = Field(..., description="Policy Holder ID")
+    member_id: List[str] = Field(..., description="Member ID")
+    start_date_of_cover: List[str] = Field(..., description="Start Date of Cover")
+    end_date_of_cover: List[str] = Field(..., description="End Date of Cover")
+    date_of_claim_treatment_date: List[str] = Field(..., description="Date of Claim/Treatment Date")
+    date_of_payment_approval_date: List[str] = Field(..., description="Date of Payment/Approval Date")
+
+    outpatient_per_family: List[float] = Field(..., description="Outpatient Limit per Family")
+    inpatient_per_family: List[float] = Field(..., description="Inpatient Limit per Family")
+
+    dental_per_individual: List[float] = Field(..., description="Dental Limit per Individual")
+    optic_per_individual: List[float] = Field(..., description="Optic Limit per Individual")
+    spectacle_frame_per_individual: List[float] = Field(..., description="Spectacle Frame Limit per Individual")
+
+    death_and_total_permanent_disability_cover_per_individual_claims: List[float] = Field(..., description="Death and Total Permanent Disability Cover per Individual (Claims)")
+
+    total_claims_paid: List[float] = Field(..., description="Total Claims Paid")
+
+    @field_validator(
+        "start_date_of_cover", "end_date_of_cover", "date_of_claim_treatment_date", "date_of_payment_approval_date"
+    )
+    @classmethod
+    def normalize_dates(cls, values: List[str]) -> List[str]:
+        # Dates are normalised to ISO once at ingest so the claims engine never re-parses formats
+        return normalize_date_column(values)
+
+    @model_validator(mode="after")
+    def check_column_lengths(self):
+        lengths = {len(values) for values in self.__dict__.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Claims bordereaux columns have different lengths: {sorted(lengths)}")
+        return self
+
+    @classmethod
+    def from_records(cls, records: Iterable[Any]) -> "ClaimsBorderauxColumns":
+        """
+        Builds the columns from claim rows given as dicts or ClaimsBorderaux instances. The rows are
+        read once, in order, so they can be streamed in from a generator.
+        """
+        columns = {field: [] for field in ClaimsBorderaux.model_fields}
+        for record in records:
+            for field, values in columns.items():
+                values.append(record.get(field) if isinstance(record, dict) else getattr(record, field))
+        return cls.model_validate(columns)
+
+    def __len__(self) -> int:
+        return len(self.member_id)
+
 class BorderauxInformation(BaseModel):
-    claims_borderaux: List[ClaimsBorderaux]
+    claims_borderaux: ClaimsBorderauxColumns
+
+    @field_validator("claims_borderaux", mode="before")
+    @classmethod
+    def claims_from_records(cls, value):
+        # Model output and older cache entries hold one object per claim
+        if isinstance(value, list):
+            return ClaimsBorderauxColumns.from_records(value)
+        return value
 
 
 class TreatyStatementInformation(BaseModel):
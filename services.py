@@ -1,27 +1,20 @@
-from typing import List, Tuple
+from typing import List, Optional
 from models import ClaimsBorderaux, TreatyStatementInformation, Treaty
 from collections import defaultdict
-from datetime import date, datetime, timedelta
+from datetime import datetime
+from dates import parse_date
+from utils import get_quarter_days
+from fraud_rules import get_fraud_rule_thresholds, get_enabled_fraud_rules
+from claims_engine import get_claim_limit
 
-def parse_date(date_string):
-    if date_string == 'N/A':
-        return None
-    try:
-        return datetime.strptime(date_string, '%Y-%m-%d')
-    except ValueError:
-        try:
-            return datetime.strptime(date_string, '%Y-%m-%d %H:%M:%S')
-        except ValueError:
-            return None
-
-def is_in_quarter(date: datetime, quarter: int) -> bool:
+def is_in_quarter(date: datetime, quarter: int, year: Optional[int] = None) -> bool:
     quarter_months = {
         1: [1, 2, 3],
         2: [4, 5, 6],
         3: [7, 8, 9],
         4: [10, 11, 12]
     }
-    return date.month in quarter_months[quarter]
+    return date.month in quarter_months[quarter] and (year is None or date.year == year)
 
 def serialize_datetime(obj):
     if isinstance(obj, datetime):
@@ -45,18 +38,66 @@ def claim_to_dict(claim: ClaimsBorderaux) -> dict:
         'total_claims_paid': claim.total_claims_paid
     }
 
-def process_claims(claims_borderauxs: List[ClaimsBorderaux], treaty_statement_info: TreatyStatementInformation, contract: Treaty, quarter: int):
-    claims_in_quarter = [
-        claim for claim in claims_borderauxs
-        if (claim_date := parse_date(claim.date_of_claim_treatment_date)) is not None and is_in_quarter(claim_date, quarter)
+def group_duplicate_claims(claims_by_member: dict, window_days: int, amount_tolerance: float) -> List[List[ClaimsBorderaux]]:
+    """
+    Clusters near-duplicate claims: the same member, treatment dates at most window_days apart and
+    amounts within amount_tolerance of each other, chained transitively.
+    :param claims_by_member: dict of member id to a list of (claim date, index, claim)
+    :return: clusters of claims in index order, clusters in order of their first claim
+    """
+    parents = {}
+
+    def find(index):
+        while parents.setdefault(index, index) != index:
+            index = parents[index]
+        return index
+
+    claims_by_index = {}
+    for member_claims in claims_by_member.values():
+        member_claims = sorted(member_claims, key=lambda item: (item[0], item[1]))
+        for position, (claim_date, index, claim) in enumerate(member_claims):
+            # Claims are sorted by date, so the comparisons stop at the end of the window
+            for other_date, other_index, other_claim in member_claims[position + 1:]:
+                if (other_date - claim_date).days > window_days:
+                    break
+                larger = max(abs(claim.total_claims_paid), abs(other_claim.total_claims_paid))
+                if abs(claim.total_claims_paid - other_claim.total_claims_paid) <= amount_tolerance * larger:
+                    parents[max(find(index), find(other_index))] = min(find(index), find(other_index))
+                    claims_by_index[index] = claim
+                    claims_by_index[other_index] = other_claim
+
+    clusters = defaultdict(list)
+    for index in sorted(claims_by_index):
+        clusters[find(index)].append(claims_by_index[index])
+    return list(clusters.values())
+
+# Fraud rules the loop implements: the five built-in rules it was written with. Rules registered
+# later with fraud_rule are only evaluated by the claims engine
+LEGACY_FRAUD_RULES = [
+    'multiple_claims_same_day', 'suspicious_claim_amounts', 'frequent_claimants', 'large_claims', 'duplicate_entries',
+]
+
+def process_claims(claims_borderauxs: List[ClaimsBorderaux], treaty_statement_info: TreatyStatementInformation, contract: Treaty, quarter: int, year: Optional[int] = None):
+    # Each date is parsed once, and kept with its claim for the checks below
+    dated_claims = [
+        (claim, claim_date) for claim in claims_borderauxs
+        if (claim_date := parse_date(claim.date_of_claim_treatment_date)) is not None and is_in_quarter(claim_date, quarter, year)
     ]
+    claims_in_quarter = [claim for claim, _ in dated_claims]
     
-    total_claims_paid = sum(claim.total_claims_paid for claim in claims_in_quarter)
+    # Started from 0.0 so an empty period totals a float, as in the engine
+    total_claims_paid = sum((claim.total_claims_paid for claim in claims_in_quarter), 0.0)
     total_premium = treaty_statement_info.total_premium
+    # Frozen reference for the engine: the legacy rules with the engine's thresholds; disabled rules are not prepared
+    enabled = {rule.name for rule in get_enabled_fraud_rules() if rule.name in LEGACY_FRAUD_RULES}
+    same_day = get_fraud_rule_thresholds('multiple_claims_same_day')
+    suspicious = get_fraud_rule_thresholds('suspicious_claim_amounts')
+    frequent = get_fraud_rule_thresholds('frequent_claimants')
+    large = get_fraud_rule_thresholds('large_claims')
+    duplicates = get_fraud_rule_thresholds('duplicate_entries')
     
-    maximum_cession_percentage = contract.treaty_details[0].maximum_cession / 100
-    claim_limit = maximum_cession_percentage * total_premium
-    exceeds_limit = total_claims_paid > claim_limit
+    claim_limit = get_claim_limit(contract, total_premium)
+    exceeds_limit = total_claims_paid > claim_limit if claim_limit is not None else None
     
     fraud_checks = {
         'multiple_claims_same_day': defaultdict(list),
@@ -66,57 +107,62 @@ def process_claims(claims_borderauxs: List[ClaimsBorderaux], treaty_statement_in
         'duplicate_entries': defaultdict(list),
     }
     
-    for claim in claims_in_quarter:
-        claim_date = parse_date(claim.date_of_claim_treatment_date)
-        if claim_date is None:
-            continue  # Skip claims with invalid dates
-        
+    for index, (claim, claim_date) in enumerate(dated_claims):
         # Check for multiple claims on the same day
-        fraud_checks['multiple_claims_same_day'][claim_date].append(claim)
+        if 'multiple_claims_same_day' in enabled:
+            fraud_checks['multiple_claims_same_day'][claim_date].append(claim)
         
         # Check for suspicious claim amounts (e.g., round numbers)
-        if claim.total_claims_paid % 1000 == 0 and claim.total_claims_paid > 10000:
+        if 'suspicious_claim_amounts' in enabled and claim.total_claims_paid % suspicious['round_multiple'] == 0 and claim.total_claims_paid > suspicious['min_amount']:
             fraud_checks['suspicious_claim_amounts'].append(claim)
         
         # Track frequent claimants
-        fraud_checks['frequent_claimants'][claim.member_id] += 1
+        if 'frequent_claimants' in enabled:
+            fraud_checks['frequent_claimants'][claim.member_id] += 1
         
         # Identify large claims
-        if claim.total_claims_paid > 0.1 * total_premium:
+        if 'large_claims' in enabled and claim.total_claims_paid > large['premium_share'] * total_premium:
             fraud_checks['large_claims'].append(claim)
         
-        # Check for duplicate entries
-        claim_key = (claim.member_id, serialize_datetime(claim_date), claim.total_claims_paid)
-        fraud_checks['duplicate_entries'][claim_key].append(claim)
+        # Collect each member's claims for the duplicate entries check
+        if 'duplicate_entries' in enabled:
+            fraud_checks['duplicate_entries'][claim.member_id].append((claim_date, index, claim))
     
-    # Process fraud checks
-    fraud_results = {
-        'multiple_claims_same_day': [
+    # Process fraud checks, each only when its rule is enabled
+    fraud_results = {}
+    if 'multiple_claims_same_day' in enabled:
+        fraud_results['multiple_claims_same_day'] = [
             (serialize_datetime(date), [claim_to_dict(c) for c in claims]) for date, claims in fraud_checks['multiple_claims_same_day'].items()
-            if len(claims) > 3
-        ],
-        'suspicious_claim_amounts': [claim_to_dict(c) for c in fraud_checks['suspicious_claim_amounts']],
-        'frequent_claimants': [
+            if len(claims) > same_day['max_claims_per_day']
+        ]
+    if 'suspicious_claim_amounts' in enabled:
+        fraud_results['suspicious_claim_amounts'] = [claim_to_dict(c) for c in fraud_checks['suspicious_claim_amounts']]
+    if 'frequent_claimants' in enabled:
+        fraud_results['frequent_claimants'] = [
             (member_id, count) for member_id, count in fraud_checks['frequent_claimants'].items()
-            if count > 5
-        ],
-        'large_claims': [claim_to_dict(c) for c in fraud_checks['large_claims']],
-        'duplicate_entries': [
-            [claim_to_dict(c) for c in claims] for claims in fraud_checks['duplicate_entries'].values()
-            if len(claims) > 1
-        ],
-    }
+            if count > frequent['max_claims']
+        ]
+    if 'large_claims' in enabled:
+        fraud_results['large_claims'] = [claim_to_dict(c) for c in fraud_checks['large_claims']]
+    if 'duplicate_entries' in enabled:
+        fraud_results['duplicate_entries'] = [
+            [claim_to_dict(c) for c in claims] for claims in group_duplicate_claims(fraud_checks['duplicate_entries'], **duplicates)
+        ]
     
     # Calculate additional statistics
-    quarter_days = 92  # Approximate number of days in a quarter
-    claim_frequency = len(claims_in_quarter) / quarter_days
+    # Days in the quarter of each year analysed, counting leap days
+    years = [year] if year is not None else {claim_date.year for _, claim_date in dated_claims}
+    quarter_days = sum(get_quarter_days(quarter, claim_year) for claim_year in years)
+    claim_frequency = len(claims_in_quarter) / quarter_days if quarter_days else 0
     average_claim_amount = total_claims_paid / len(claims_in_quarter) if claims_in_quarter else 0
     
     results = {
         'quarter': quarter,
+        'year': year,
         'total_claims_paid': total_claims_paid,
         'claim_limit': claim_limit,
         'exceeds_limit': exceeds_limit,
+        'limit_usage': total_claims_paid / claim_limit * 100 if claim_limit else None,
         'fraud_checks': fraud_results,
         'claim_frequency': claim_frequency,
         'average_claim_amount': average_claim_amount,
@@ -0,0 +1,100 @@
+import json
+import pytest
+from data_loader import DocumentExtractor
+
+
+def make_claim(row):
+    return {
+        "policy_holder_id": "HOLDER 1", "member_id": f"MEMBER {row}",
+        "start_date_of_cover": "2020-01-01", "end_date_of_cover": "2020-12-31",
+        "date_of_claim_treatment_date": "2020-07-01", "date_of_payment_approval_date": "2020-07-05",
+        "outpatient_per_family": 100.0, "inpatient_per_family": 0.0, "dental_per_individual": 0.0,
+        "optic_per_individual": 0.0, "spectacle_frame_per_individual": 0.0,
+        "death_and_total_permanent_disability_cover_per_individual_claims": 0.0, "total_claims_paid": 100.0,
+    }
+
+
+class RowsPrompt:
+    # Stands in for the prompt template; the rows of the chunk are the whole prompt
+    def format(self, html_table_data):
+        return html_table_data
+
+
+class FakeModel:
+    """
+    Streams a JSON response in small pieces. answer(rows, call) gives the claims of each request.
+    """
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = []
+
+    def stream(self, prompt):
+        rows = prompt.split("|")
+        self.requests.append(rows)
+        text = json.dumps({"claims_borderaux": self.answer(rows, len(self.requests))})
+        for start in range(0, len(text), 16):
+            yield text[start:start + 16]
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    monkeypatch.setattr("data_loader.render_html_chunk", lambda header_html, rows: "|".join(rows))
+    extractor = DocumentExtractor.__new__(DocumentExtractor)
+    extractor.borderaux_prompt = RowsPrompt()
+    return extractor
+
+
+def extract(extractor, answer, rows):
+    extractor.borderaux_model = FakeModel(answer)
+    return [claim.member_id for claim in extractor.stream_chunk_claims("", rows)]
+
+
+ROWS = [str(row) for row in range(6)]
+ALL_MEMBERS = [f"MEMBER {row}" for row in ROWS]
+
+
+def test_clean_response(extractor):
+    assert extract(extractor, lambda rows, call: [make_claim(row) for row in rows], ROWS) == ALL_MEMBERS
+    assert extractor.borderaux_model.requests == [ROWS]
+
+
+def test_rows_from_an_invalid_claim_on_are_requested_again(extractor):
+    def answer(rows, call):
+        return [{"member_id": "broken"} if row == "2" and call == 1 else make_claim(row) for row in rows]
+
+    assert extract(extractor, answer, ROWS) == ALL_MEMBERS
+    assert extractor.borderaux_model.requests == [ROWS, ROWS[2:]]
+
+
+def test_missing_claims_are_requested_again(extractor):
+    def answer(rows, call):
+        return [make_claim(row) for row in (rows[:-2] if call == 1 else rows)]
+
+    assert extract(extractor, answer, ROWS) == ALL_MEMBERS
+    assert extractor.borderaux_model.requests == [ROWS, ROWS[4:]]
+
+
+def test_row_that_never_validates_fails(extractor):
+    def answer(rows, call):
+        return [{"member_id": "broken"} if row == "3" else make_claim(row) for row in rows]
+
+    with pytest.raises(ValueError, match="Unable to extract borderaux row"):
+        extract(extractor, answer, ROWS)
+
+
+def test_more_claims_than_rows_fails(extractor):
+    def answer(rows, call):
+        return [make_claim(row) for row in rows] + [make_claim("extra")]
+
+    with pytest.raises(ValueError, match="more claims than"):
+        extract(extractor, answer, ROWS)
+
+
+def test_chunks_are_yielded_in_row_order(extractor):
+    extractor.borderaux_model = FakeModel(lambda rows, call: [make_claim(row) for row in rows])
+    chunks = [("", [f"{chunk}-{row}" for row in range(3)]) for chunk in range(10)]
+
+    members = [claim.member_id for claim in extractor.iter_borderaux_claims(chunks)]
+
+    assert members == [f"MEMBER {chunk}-{row}" for chunk in range(10) for row in range(3)]
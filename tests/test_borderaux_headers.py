@@ -0,0 +1,64 @@
+from datetime import datetime
+from openpyxl import Workbook
+from Ingestion.ingest import extract_claims_borderaux_from_xlsx_workbook, map_claims_borderaux_columns
+
+AMOUNT_HEADERS = [
+    "Outpatient Limit per Family", "Inpatient per Family", "Dental per Individual", "Optic per Individual",
+    "Spectacle Frame per Individual", "Death and Total Permanent Disability Cover per Individual", "Total Claims Paid",
+]
+TEXT_HEADERS = [
+    "Policy Holder ID", "Member ID", "Start Date of Cover", "End Date of Cover",
+    "Date of Claim / Treatment Date", "Date of Payment / Approval Date",
+]
+
+
+def write_workbook(path, rows):
+    workbook = Workbook()
+    worksheet = workbook.active
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(path)
+
+
+def test_amounts_are_taken_from_the_amount_paid_group():
+    # Claimed amounts come first under their own merged group header, then the paid ones
+    group_row = [None] * len(TEXT_HEADERS) + ["Amount Claimed"] + [None] * 6 + ["Amount Paid"] + [None] * 6
+    header_row = TEXT_HEADERS + AMOUNT_HEADERS + AMOUNT_HEADERS
+
+    column_map = map_claims_borderaux_columns(tuple(header_row), tuple(group_row))
+
+    assert column_map["member_id"] == 1
+    assert column_map["outpatient_per_family"] == len(TEXT_HEADERS) + len(AMOUNT_HEADERS)
+    assert column_map["total_claims_paid"] == len(header_row) - 1
+
+
+def test_unrecognised_headers_do_not_map():
+    assert map_claims_borderaux_columns(("Name", "Amount", "Date")) is None
+
+
+def test_workbook_rows_are_read_by_header(tmp_path):
+    path = tmp_path / "borderaux.xlsx"
+    write_workbook(path, [
+        ["Claims bordereaux, third quarter"],
+        TEXT_HEADERS + AMOUNT_HEADERS,
+        ["HOLDER 1", "MEMBER 1", "01/01/2020", "31/12/2020", datetime(2020, 7, 3), "2020-07-10", 100, 0, 0, 0, 0, 0, 100],
+        # Merged policy holder cell, amounts written as text
+        [None, "MEMBER 2", "01/01/2020", "31/12/2020", "2020-08-01", "2020-08-05", "1,250.50", None, 0, 0, 0, 0, "1,250.50"],
+        # Totals row
+        [None, None, None, None, None, None, 1350.5, 0, 0, 0, 0, 0, 1350.5],
+    ])
+
+    columns = extract_claims_borderaux_from_xlsx_workbook(str(path))
+
+    assert columns["policy_holder_id"] == ["HOLDER 1", "HOLDER 1"]
+    assert columns["member_id"] == ["MEMBER 1", "MEMBER 2"]
+    assert columns["date_of_claim_treatment_date"] == ["2020-07-03", "2020-08-01"]
+    assert columns["outpatient_per_family"] == [100.0, 1250.5]
+    assert columns["inpatient_per_family"] == [0.0, 0.0]
+
+
+def test_workbook_without_claims_headers(tmp_path):
+    path = tmp_path / "premiums.xlsx"
+    write_workbook(path, [["Policy Holder ID", "Premium"], ["HOLDER 1", 1000]])
+
+    assert extract_claims_borderaux_from_xlsx_workbook(str(path)) is None
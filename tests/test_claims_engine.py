@@ -0,0 +1,66 @@
+import json
+from datetime import date
+import pytest
+import fraud_rules
+from models import ClaimsBorderauxColumns, TreatyStatementInformation, Treaty, TreatyDetail
+from claims_engine import load_claims_frame, process_claims_frame, process_claims_by_period
+from services import process_claims, LEGACY_FRAUD_RULES
+from benchmark_claims import generate_claims
+
+STATEMENT = TreatyStatementInformation(
+    reinsured="", treaty="", period="", total_premium=40880330.4,
+    total_claims=0.0, share_balance=0.0, share_percentage=0.0
+)
+CONTRACT = Treaty(
+    reinsured="", start_date=date(2020, 1, 1), end_date=date(2020, 12, 31), treaty_type="",
+    business_covered=[], territorial_scope="", reinsurer_participations=[],
+    treaty_details=[TreatyDetail(limits=[], retention_percentage=0.0, maximum_cession=60.0)],
+)
+
+
+@pytest.fixture(scope="module")
+def claims():
+    # Few members, so every fraud check flags some claims
+    return generate_claims(4000, members=150, seed=3)
+
+
+def engine_results(claims, quarter, year=None):
+    results = process_claims_frame(load_claims_frame(ClaimsBorderauxColumns.from_records(claims)), STATEMENT, CONTRACT, quarter, year)
+    results.pop("fraud_rule_seconds")
+    return results
+
+
+def same(left, right):
+    return json.dumps(left, sort_keys=True) == json.dumps(right, sort_keys=True)
+
+
+@pytest.mark.parametrize("quarter, year", [(1, None), (3, None), (3, 2020), (2, 2019)])
+def test_engine_matches_the_loop(claims, quarter, year):
+    expected = process_claims(claims, STATEMENT, CONTRACT, quarter, year)
+    results = engine_results(claims, quarter, year)
+
+    assert sorted(results["fraud_checks"]) == sorted(LEGACY_FRAUD_RULES)
+    assert same(results, expected)
+
+
+def test_engine_matches_the_loop_with_rules_disabled(claims, monkeypatch):
+    config = {"duplicate_entries": {"enabled": False}, "large_claims": {"premium_share": 0.001}}
+    monkeypatch.setattr(fraud_rules, "load_fraud_rules_config", lambda: config)
+
+    expected = process_claims(claims, STATEMENT, CONTRACT, 3)
+    results = engine_results(claims, 3)
+
+    assert "duplicate_entries" not in results["fraud_checks"]
+    assert results["fraud_checks"]["large_claims"]
+    assert same(results, expected)
+
+
+def test_all_periods_match_each_quarter(claims):
+    frame = load_claims_frame(ClaimsBorderauxColumns.from_records(claims))
+    quarterly = [process_claims_frame(frame, STATEMENT, CONTRACT, quarter, 2020) for quarter in range(1, 5)]
+    by_period = process_claims_by_period(frame, STATEMENT, CONTRACT, 2020)
+    for results in quarterly + by_period["periods"]:
+        results.pop("fraud_rule_seconds")
+
+    assert same(by_period["periods"], quarterly)
+    assert by_period["total_claims_paid"] == pytest.approx(sum(results["total_claims_paid"] for results in quarterly))
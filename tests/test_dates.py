@@ -0,0 +1,33 @@
+from datetime import date, datetime
+from dates import normalize_date, normalize_date_column, parse_date
+
+
+def test_parse_date_formats():
+    assert parse_date("2020-07-01") == datetime(2020, 7, 1)
+    assert parse_date("01/07/2020") == datetime(2020, 7, 1)
+    assert parse_date("1st July 2020") == datetime(2020, 7, 1)
+    assert parse_date("N/A") is None
+
+
+def test_normalize_date():
+    assert normalize_date(date(2020, 7, 1)) == "2020-07-01"
+    assert normalize_date(datetime(2020, 7, 1, 12, 30)) == "2020-07-01"
+    assert normalize_date(None) == ""
+    assert normalize_date(" unknown ") == "unknown"
+
+
+def test_column_in_one_format():
+    assert normalize_date_column(["01/07/2020", "15/08/2020", "01/07/2020"]) == ["2020-07-01", "2020-08-15", "2020-07-01"]
+
+
+def test_column_with_mixed_formats_and_blanks():
+    # Values outside the detected format fall back to parsing each one
+    values = ["01/07/2020", "", "2 August 2020", "2020-09-03 00:00:00", "N/A"]
+
+    assert normalize_date_column(values) == ["2020-07-01", "", "2020-08-02", "2020-09-03", "N/A"]
+
+
+def test_iso_column_is_returned_as_is():
+    values = ["2020-07-01", "", "2020-08-15"]
+
+    assert normalize_date_column(values) is values
@@ -0,0 +1,70 @@
+from collections import defaultdict
+from models import ClaimsBorderaux, ClaimsBorderauxColumns
+from dates import parse_date
+from claims_frame import claims_to_frame
+from fraud_rules import find_duplicate_clusters
+from services import group_duplicate_claims
+from benchmark_claims import generate_claims
+
+
+def make_claim(member_id, treatment_date, amount):
+    return ClaimsBorderaux(
+        policy_holder_id="HOLDER 1", member_id=member_id,
+        start_date_of_cover="2020-01-01", end_date_of_cover="2020-12-31",
+        date_of_claim_treatment_date=treatment_date, date_of_payment_approval_date=treatment_date,
+        outpatient_per_family=amount, inpatient_per_family=0.0, dental_per_individual=0.0,
+        optic_per_individual=0.0, spectacle_frame_per_individual=0.0,
+        death_and_total_permanent_disability_cover_per_individual_claims=0.0, total_claims_paid=amount,
+    )
+
+
+def clusters_of(claims, window_days=1, amount_tolerance=0.01):
+    frame = claims_to_frame(ClaimsBorderauxColumns.from_records(claims), ["member_id", "claim_date", "total_claims_paid"])
+    return [cluster.tolist() for cluster in find_duplicate_clusters(frame, window_days, amount_tolerance)]
+
+
+def test_claims_close_in_date_and_amount_are_clustered():
+    claims = [
+        make_claim("MEMBER 1", "2020-07-01", 1000.0),
+        make_claim("MEMBER 2", "2020-07-01", 1000.0),
+        make_claim("MEMBER 1", "2020-07-02", 1005.0),
+        # Two days after the first claim, or twice the amount: not duplicates
+        make_claim("MEMBER 1", "2020-07-04", 1000.0),
+        make_claim("MEMBER 1", "2020-07-01", 2000.0),
+    ]
+
+    assert clusters_of(claims) == [[0, 2]]
+
+
+def test_clusters_are_chained_transitively():
+    # Each claim is a day after the previous one, so the first and last are only linked through the middle one
+    claims = [
+        make_claim("MEMBER 1", "2020-07-01", 1000.0),
+        make_claim("MEMBER 1", "2020-07-02", 1000.0),
+        make_claim("MEMBER 1", "2020-07-03", 1000.0),
+    ]
+
+    assert clusters_of(claims) == [[0, 1, 2]]
+    assert clusters_of(claims, window_days=0) == []
+
+
+def test_claims_without_a_valid_date_are_left_out():
+    claims = [make_claim("MEMBER 1", "N/A", 1000.0), make_claim("MEMBER 1", "N/A", 1000.0)]
+
+    assert clusters_of(claims) == []
+
+
+def test_matches_the_loop_on_a_generated_bordereaux():
+    claims = generate_claims(3000, members=100, seed=1)
+    claims_by_member = defaultdict(list)
+    for index, claim in enumerate(claims):
+        claims_by_member[claim.member_id].append((parse_date(claim.date_of_claim_treatment_date), index, claim))
+    positions = {id(claim): index for index, claim in enumerate(claims)}
+
+    expected = [
+        [positions[id(claim)] for claim in cluster]
+        for cluster in group_duplicate_claims(claims_by_member, window_days=3, amount_tolerance=0.05)
+    ]
+
+    assert expected
+    assert clusters_of(claims, window_days=3, amount_tolerance=0.05) == expected
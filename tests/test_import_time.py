@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import pytest
+from check_import_time import LAZY_MODULES, measure_import
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Same budget as check_import_time.py's default
+IMPORT_BUDGET = 1.5
+
+
+def imported_lazy_modules(module, timings):
+    lazy_modules = [lazy for lazy in LAZY_MODULES if lazy != module]
+    return sorted(name for name in timings if any(name == lazy or name.startswith(f"{lazy}.") for lazy in lazy_modules))
+
+
+@pytest.mark.parametrize("module", ["app", "data_loader", "jobs", "cache"])
+def test_import_does_not_load_the_extraction_stacks(module):
+    timings = measure_import(module)
+
+    assert module in timings
+    assert imported_lazy_modules(module, timings) == []
+
+
+def test_app_import_stays_within_budget():
+    assert measure_import("app")["app"] <= IMPORT_BUDGET
+
+
+def test_cache_import_has_no_output():
+    # The cache client is only created on first use
+    completed = subprocess.run([sys.executable, "-c", "import cache"], capture_output=True, text=True, cwd=REPOSITORY_ROOT)
+
+    assert completed.returncode == 0
+    assert completed.stdout == ""
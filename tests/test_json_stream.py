@@ -0,0 +1,61 @@
+import json
+import pytest
+from json_stream import JsonArrayStreamParser
+
+CLAIMS = [
+    {"member_id": "MEMBER 1", "note": "brace } and bracket ] in a string", "total_claims_paid": 100.0},
+    {"member_id": "MEMBER \"2\"", "details": {"codes": [1, 2]}, "total_claims_paid": 250.5},
+    {"member_id": "MEMBER \\ 3", "total_claims_paid": 0},
+]
+RESPONSE = json.dumps({
+    "premium_borderaux": [{"policy_holder_id": "HOLDER 1"}],
+    "claims_borderaux": CLAIMS,
+    "summary": {"claims_borderaux": "not the array"},
+})
+
+
+def feed_all(parser, pieces):
+    items = []
+    for piece in pieces:
+        items.extend(parser.feed(piece))
+    return items
+
+
+def test_whole_response():
+    parser = JsonArrayStreamParser("claims_borderaux")
+
+    assert parser.feed(RESPONSE) == CLAIMS
+    assert parser.finished
+
+
+@pytest.mark.parametrize("piece_size", [1, 2, 7, 64])
+def test_response_split_into_pieces(piece_size):
+    parser = JsonArrayStreamParser("claims_borderaux")
+    pieces = [RESPONSE[start:start + piece_size] for start in range(0, len(RESPONSE), piece_size)]
+
+    assert feed_all(parser, pieces) == CLAIMS
+    assert parser.finished
+
+
+def test_items_are_returned_as_soon_as_they_close():
+    parser = JsonArrayStreamParser("claims_borderaux")
+    first_claim_end = RESPONSE.index(json.dumps(CLAIMS[0])) + len(json.dumps(CLAIMS[0]))
+
+    assert parser.feed(RESPONSE[:first_claim_end]) == CLAIMS[:1]
+    assert not parser.finished
+
+
+def test_truncated_response_keeps_complete_items():
+    parser = JsonArrayStreamParser("claims_borderaux")
+    # Cut in the middle of the second claim
+    cut = RESPONSE.index(json.dumps(CLAIMS[1])) + 20
+
+    assert parser.feed(RESPONSE[:cut]) == CLAIMS[:1]
+    assert not parser.finished
+
+
+def test_response_without_the_array():
+    parser = JsonArrayStreamParser("claims_borderaux")
+
+    assert parser.feed(json.dumps({"premium_borderaux": []})) == []
+    assert parser.finished
@@ -0,0 +1,37 @@
+import os
+import tempfile
+from typing import BinaryIO, Tuple
+from cache import HASH_CHUNK_SIZE, new_file_hash, remember_file_hash
+
+
+def save_upload(file_object: BinaryIO, upload_dir: str, suffix: str) -> Tuple[str, str]:
+    """
+    Copies an uploaded file to disk in one chunked pass, hashing it on the way, and stores it under
+    its content hash so identical uploads are kept once. The stage caches reuse the hash instead of
+    reading the file again.
+    :param file_object: uploaded file, read from its start
+    :param upload_dir: directory of stored uploads
+    :param suffix: file extension, e.g. '.pdf'
+    :return: (content hash, path of the stored file)
+    """
+    file_hash = new_file_hash()
+    file_object.seek(0)
+    with tempfile.NamedTemporaryFile(dir=upload_dir, suffix=".part", delete=False) as temporary_file:
+        try:
+            for chunk in iter(lambda: file_object.read(HASH_CHUNK_SIZE), b""):
+                file_hash.update(chunk)
+                temporary_file.write(chunk)
+        except BaseException:
+            temporary_file.close()
+            os.remove(temporary_file.name)
+            raise
+    file_object.seek(0)
+
+    digest = file_hash.hexdigest()
+    path = os.path.join(upload_dir, f"{digest}{suffix}")
+    if os.path.exists(path):
+        os.remove(temporary_file.name)
+    else:
+        os.replace(temporary_file.name, path)
+    remember_file_hash(path, digest)
+    return digest, path
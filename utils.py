@@ -12,4 +12,8 @@ def get_quarter_dates(quarter: int, year: int) -> Tuple[datetime, datetime]:
     elif quarter == 4:
         return datetime(year, 10, 1), datetime(year, 12, 31)
     else:
-        raise ValueError("Invalid quarter. Please choose between 1 and 4.")
\ No newline at end of file
+        raise ValueError("Invalid quarter. Please choose between 1 and 4.")
+
+def get_quarter_days(quarter: int, year: int) -> int:
+    start_date, end_date = get_quarter_dates(quarter, year)
+    return (end_date - start_date).days + 1